@@ -0,0 +1,105 @@
+# Local stand-in for the Telegram Bot API, enough for TeleBot to run offline.
+# Serves getUpdates (with offset and long polling) from updates posted to it
+# and records every sendMessage call.
+# Usage: python benchmarks/fake_telegram.py [port]
+#        then type '<chat_id> <text>' lines to post them as updates
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+class FakeTelegram:
+    """ url is what TeleBot should use as its API_URL, e.g.
+    constants.API_URL = fake.url, the token in the path is not checked.
+    on_send(chat_id, text, ts) is called for each sendMessage. """
+
+    def __init__(self, host="127.0.0.1", port=0, on_send=None):
+        self.update_id = 0
+        self.pending = [] # updates not confirmed by an offset yet
+        self.sent = []    # (ts, chat_id, text)
+        self.on_send = on_send
+        self.cond = threading.Condition()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.url = "http://{}:{}/bot{{}}/".format(*self.server.server_address)
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, chat_id, text):
+        """ Queues a text message from chat_id, returns the time it became visible """
+        with self.cond:
+            self.update_id += 1
+            self.pending.append({"update_id": self.update_id,
+                                 "message": {"message_id": self.update_id,
+                                             "chat": {"id": chat_id, "type": "group"},
+                                             "date": int(time.time()), "text": text}})
+            self.cond.notify_all()
+            return time.perf_counter()
+
+    def get_updates(self, offset=None, timeout=0, limit=100):
+        with self.cond:
+            if offset is not None:
+                self.pending = [u for u in self.pending if u["update_id"] >= offset]
+            self.cond.wait_for(lambda: self.pending, timeout)
+            return self.pending[:limit]
+
+    def send_message(self, chat_id, text):
+        ts = time.perf_counter()
+        with self.cond:
+            self.sent.append((ts, chat_id, text))
+        if self.on_send: self.on_send(chat_id, text, ts)
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                method = url.path.rsplit("/", 1)[-1]
+                if method == "getUpdates":
+                    offset = params.get("offset")
+                    result = api.get_updates(None if offset is None else int(offset),
+                                             int(params.get("timeout", 0)),
+                                             int(params.get("limit", 100)))
+                elif method == "sendMessage":
+                    chat_id = params["chat_id"]
+                    if chat_id.lstrip("-").isdigit(): chat_id = int(chat_id)
+                    api.send_message(chat_id, params.get("text", ""))
+                    result = {"message_id": 0, "chat": {"id": chat_id}, "text": params.get("text", "")}
+                else:
+                    return self.reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                self.reply(200, {"ok": True, "result": result})
+
+            def reply(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args): pass # quiet
+
+        return Handler
+
+if __name__ == "__main__":
+    import sys
+    fake = FakeTelegram(port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081,
+                        on_send=lambda chat_id, text, ts: print("{} <<< {}".format(chat_id, text)))
+    print("Serving", fake.url.format("<token>"))
+    fake.start()
+    for line in sys.stdin:
+        chat_id, _, text = line.strip().partition(" ")
+        if text: fake.post(int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id, text)
+    fake.stop()
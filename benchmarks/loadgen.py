@@ -0,0 +1,206 @@
+# End-to-end load test: runs main() against benchmarks/fake_telegram.py, fully offline.
+# Each chat registers a roster and a session, then every burst has members check in
+# (/present, /late, /absent, the odd /report) the way a choir does at the door.
+# Latency is from an update becoming visible on getUpdates to its sendMessage reply.
+# Usage: python benchmarks/loadgen.py [--chats 20] [--members 30] [--bursts 3]
+#        [--processes 0] [--threads 4] [--rate 0] [--script FILE]
+
+import os, sys
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "logic"))
+sys.path.insert(0, os.path.join(HERE, ".."))
+sys.path.insert(0, HERE)
+
+import argparse
+import datetime
+import random
+import signal
+import tempfile
+import threading
+import time
+import types
+from fake_telegram import FakeTelegram
+
+FIRST = ["alex", "bryan", "chloe", "daniel", "elaine", "farhan", "grace", "hui min",
+         "isaac", "jia wei", "kumar", "lydia", "marcus", "nur", "oliver", "priya"]
+REASONS = ["mc", "work", "stuck on the MRT", "exam tomorrow", "overseas"]
+
+def typo(rng, alias):
+    """ One dropped or swapped letter, as typed in a hurry """
+    i = rng.randrange(len(alias) - 1)
+    if rng.random() < 0.5: return alias[:i] + alias[i+1:]
+    return alias[:i] + alias[i+1] + alias[i] + alias[i+2:]
+
+def generate(chats, members, bursts, seed=0):
+    """ Returns (setup, bursts): lists of (chat_id, text) """
+    rng = random.Random(seed)
+    date = (datetime.date.today() + datetime.timedelta(days=1)).isoformat()
+    setup, load = [], [[] for _ in range(bursts)]
+    for chat_id in range(1, chats + 1):
+        setup.append((chat_id, "/new practice {} 19:30 training".format(date)))
+        setup.append((chat_id, "/set {}".format(date)))
+        aliases = []
+        for i in range(members):
+            first = FIRST[i % len(FIRST)]
+            alias = "{}{}".format(first.replace(" ", ""), i)
+            setup.append((chat_id, '/new member "{} {}" {} 9{:07d} active {}'
+                          .format(first.title(), i, rng.choice(["S1", "A2", "T1", "B2"]), i, alias)))
+            aliases.append(alias)
+        for burst in load:
+            for alias in rng.sample(aliases, len(aliases)):
+                if rng.random() < 0.15: alias = typo(rng, alias)
+                r = rng.random()
+                if r < 0.75: burst.append((chat_id, "/present {}".format(alias)))
+                elif r < 0.9: burst.append((chat_id, '/late {} "{}"'.format(alias, rng.choice(REASONS))))
+                else: burst.append((chat_id, '/absent {} "{}"'.format(alias, rng.choice(REASONS))))
+                if rng.random() < 0.05: burst.append((chat_id, "/report"))
+    for burst in load: rng.shuffle(burst) # chats check in at the same time
+    return setup, load
+
+def read_script(path):
+    """ '<chat_id> <text>' per line, a blank line starts the next burst, # comments.
+    Lines before the first blank line are setup and not timed. """
+    phases = [[]]
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#"): continue
+            if not line:
+                if phases[-1]: phases.append([])
+                continue
+            chat_id, _, text = line.partition(" ")
+            phases[-1].append((int(chat_id) if chat_id.lstrip("-").isdigit() else chat_id, text))
+    if not phases[-1]: phases.pop()
+    return phases[0], phases[1:]
+
+def percentile(values, p):
+    if not values: return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p/100 * (len(values) - 1))))]
+
+class Replay:
+    """ Posts updates to the fake API and pairs each reply with its command.
+    A chat's commands are handled in order with exactly one reply each,
+    so the n-th reply to a chat answers its n-th command. """
+
+    def __init__(self, api):
+        self.api = api
+        self.lock = threading.Lock()
+        self.waiting = {}  # chat_id -> [post times]
+        self.latencies = []
+        self.outstanding = 0
+        self.done = threading.Event()
+        api.on_send = self.on_send
+
+    def on_send(self, chat_id, text, ts):
+        with self.lock:
+            waiting = self.waiting.get(chat_id)
+            if not waiting: return # e.g. scheduled reminders
+            self.latencies.append(ts - waiting.pop(0))
+            self.outstanding -= 1
+            if self.outstanding == 0: self.done.set()
+
+    def run(self, messages, rate=0, timeout=120):
+        """ Posts messages (rate per second, 0 for all at once) and waits for every reply """
+        with self.lock:
+            self.latencies = []
+            self.outstanding += len(messages)
+            self.done.clear()
+        start = time.perf_counter()
+        for i, (chat_id, text) in enumerate(messages):
+            if rate:
+                delay = start + i/rate - time.perf_counter()
+                if delay > 0: time.sleep(delay)
+            with self.lock: # its reply cannot be paired before this is recorded
+                self.waiting.setdefault(chat_id, []).append(self.api.post(chat_id, text))
+        if messages and not self.done.wait(timeout):
+            raise RuntimeError("{} replies still missing after {}s".format(self.outstanding, timeout))
+        return time.perf_counter() - start, list(self.latencies)
+
+def configure(**values):
+    """ Points main() at the fake API. constants.py holds the real token and
+    is optional here; returns the previous values for restore(). """
+    constants = sys.modules.get("constants")
+    if constants is None:
+        try:
+            import constants
+        except ImportError:
+            constants = sys.modules["constants"] = types.ModuleType("constants")
+    missing = object()
+    old = {k: getattr(constants, k, missing) for k in values}
+    for k, v in values.items(): setattr(constants, k, v)
+    return constants, {k: v for k, v in old.items() if v is not missing}, [k for k, v in old.items() if v is missing]
+
+def restore(constants, old, added):
+    for k, v in old.items(): setattr(constants, k, v)
+    for k in added: delattr(constants, k)
+
+def run(setup, bursts, processes=0, threads=4, rate=0, timeout=120, out=print):
+    """ Runs main() on this thread until every burst is answered, returns the stats """
+    api = FakeTelegram().start()
+    replay = Replay(api)
+    stats = {}
+    with tempfile.TemporaryDirectory() as d:
+        constants, old, added = configure(TOKEN="offline", API_URL=api.url,
+                                          DATA_DIR=os.path.join(d, "data"),
+                                          CHATS_FILE=os.path.join(d, "chats.json"),
+                                          POLL_TIMEOUT=1, WORKERS=threads)
+        sigint = signal.getsignal(signal.SIGINT)
+        import main as bot_main
+
+        def drive():
+            try:
+                elapsed, _ = replay.run(setup, timeout=timeout)
+                out("setup: {} commands in {:.2f}s".format(len(setup), elapsed))
+                latencies, commands, busy = [], 0, 0.0
+                for i, burst in enumerate(bursts):
+                    elapsed, lat = replay.run(burst, rate, timeout)
+                    out("burst {}: {} commands in {:.2f}s, {:.0f} cmd/s, p50 {:.1f}ms, p99 {:.1f}ms"
+                        .format(i + 1, len(burst), elapsed, len(burst)/elapsed,
+                                1000*percentile(lat, 50), 1000*percentile(lat, 99)))
+                    latencies += lat
+                    commands += len(burst)
+                    busy += elapsed
+                stats.update(commands=commands, seconds=busy,
+                             throughput=commands/busy if busy else 0.0,
+                             p50=percentile(latencies, 50), p99=percentile(latencies, 99),
+                             max=max(latencies, default=float("nan")))
+            except BaseException as e:
+                stats["error"] = e
+            finally:
+                os.kill(os.getpid(), signal.SIGINT) # main() stops after its current poll
+
+        driver = threading.Thread(target=drive, daemon=True)
+        driver.start()
+        try:
+            bot_main.main(processes)
+        finally:
+            signal.signal(signal.SIGINT, sigint)
+            driver.join()
+            api.stop()
+            restore(constants, old, added)
+    if "error" in stats: raise stats["error"]
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--members", type=int, default=30, help="roster size per chat")
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=0)
+    parser.add_argument("--threads", type=int, default=4, help="worker threads per process")
+    parser.add_argument("--rate", type=float, default=0, help="updates/s within a burst, 0 posts all at once")
+    parser.add_argument("--script", help="replay '<chat_id> <text>' lines instead")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.script: setup, bursts = read_script(args.script)
+    else: setup, bursts = generate(args.chats, args.members, args.bursts, args.seed)
+    print("{} processes x {} threads".format(args.processes, args.threads))
+    stats = run(setup, bursts, args.processes, args.threads, args.rate)
+    print("total: {} commands, {:.0f} cmd/s, p50 {:.1f}ms, p99 {:.1f}ms, max {:.1f}ms"
+          .format(stats["commands"], stats["throughput"], 1000*stats["p50"],
+                  1000*stats["p99"], 1000*stats["max"]))
+
+if __name__ == "__main__":
+    main()
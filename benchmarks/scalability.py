@@ -0,0 +1,196 @@
+# How the DB and fuzzy alias matching scale with roster size and session count.
+# Synthetic rosters get generated names, nicknames and typo'd check-ins; every
+# op is timed per call and results are written as JSON to compare across commits.
+# Usage: python benchmarks/scalability.py [--members 50 500 5000 50000]
+#        [--sessions 10 1000 10000] [--samples 50] [--out scalability.json]
+#        [--compare old.json]
+
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logic"))
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import sqlite3
+import subprocess
+import time
+import bktree
+import algorithm
+
+SYLLABLES = ["al", "an", "bo", "chen", "da", "el", "fa", "gi", "hui", "ian", "jo", "ka",
+             "li", "ma", "min", "na", "ong", "pa", "qi", "ra", "sa", "shu", "ta", "ting",
+             "wei", "xi", "ya", "yu", "zh", "zi"]
+SECTIONS = ["S1", "S2", "A1", "A2", "T1", "T2", "B1", "B2"]
+REPORTS = [("full", "."), ("reason", "."), ("absent", "."), ("full", "S"), ("absent", "A1")]
+
+def word(rng, n):
+    return "".join(rng.choice(SYLLABLES) for _ in range(n))
+
+def roster(members, seed=0):
+    """ [(name, section, nickname)] with unique names and nicknames """
+    rng = random.Random(seed)
+    names, nicknames, rows = set(), set(), []
+    while len(rows) < members:
+        first, last = word(rng, rng.randint(1, 3)), word(rng, rng.randint(1, 2))
+        name = "{} {}".format(first.title(), last.title())
+        nickname = first if rng.random() < 0.6 else first + last[0]
+        if name in names or nickname in nicknames: continue
+        names.add(name)
+        nicknames.add(nickname)
+        rows.append((name, rng.choice(SECTIONS), nickname))
+    return rows
+
+def typo(rng, alias):
+    """ A dropped, swapped, doubled or wrong letter, the way names get typed in """
+    i = rng.randrange(len(alias))
+    kind = rng.randrange(4)
+    if kind == 0 and len(alias) > 2: return alias[:i] + alias[i+1:]
+    if kind == 1 and i < len(alias) - 1: return alias[:i] + alias[i+1] + alias[i] + alias[i+2:]
+    if kind == 2: return alias[:i] + alias[i] + alias[i:]
+    return alias[:i] + rng.choice("aeiounst") + alias[i+1:]
+
+def queries(rng, rows, samples):
+    """ Check-in queries, a third of them typo'd """
+    picks = [rng.choice(rows)[2] for _ in range(samples)]
+    return [typo(rng, q) if rng.random() < 1/3 else q for q in picks]
+
+def timed(f, args_list):
+    """ Runs f(*args) for each args, returns per-call seconds """
+    times = []
+    for args in args_list:
+        start = time.perf_counter()
+        f(*args)
+        times.append(time.perf_counter() - start)
+    return times
+
+def summary(op, times, **params):
+    times = sorted(times)
+    return dict(params, op=op, calls=len(times),
+                mean_ms=1000*sum(times)/len(times),
+                p50_ms=1000*times[len(times)//2],
+                max_ms=1000*times[-1])
+
+def failure(op, e, **params):
+    return dict(params, op=op, error="{}: {}".format(type(e).__name__, e))
+
+def bench_bktree(rows, samples, seed=0):
+    rng = random.Random(seed)
+    words = [r[0].replace(" ", "").lower() for r in rows] + [r[2] for r in rows]
+    start = time.perf_counter()
+    tree = bktree.build(words)
+    results = [summary("bktree.build", [time.perf_counter() - start], members=len(rows))]
+    qs = [(q,) for q in queries(rng, rows, samples)]
+    results.append(summary("BKTree.search", timed(tree.search, qs), members=len(rows)))
+    return results
+
+def bench_db(rows, sessions, samples, seed=0, config=None):
+    """ Loads a MemoryDB (or config) and times each op on it.
+    Stops loading members at the first failure, e.g. SQLite's column limit,
+    and carries on with the members that fit. """
+    rng = random.Random(seed)
+    params = {"members": len(rows), "sessions": sessions}
+    results = []
+    db = algorithm.MemoryDB(config)
+    try:
+        day = datetime.date(2018, 1, 1).toordinal()
+        dates = [algorithm.ordinal_to_date(day + i) for i in range(sessions)]
+        results.append(summary("add_session", timed(db.add_session, [(d, "19:30", "practice") for d in dates]), **params))
+
+        loaded, times = [], []
+        for name, section, nickname in rows:
+            start = time.perf_counter()
+            try:
+                db.add_member(name, section, "91234567", "active", nickname)
+            except (AssertionError, sqlite3.Error) as e:
+                results.append(failure("add_member", e, loaded=len(loaded), **params))
+                break
+            times.append(time.perf_counter() - start)
+            loaded.append((name, section, nickname))
+        if times: results.append(summary("add_member", times, loaded=len(loaded), **params))
+        if not loaded: return results
+        params["loaded"] = len(loaded)
+
+        qs = queries(rng, loaded, samples)
+        results.append(summary("match_alias_to_name", timed(db.match_alias_to_name, [(q,) for q in qs]), **params))
+
+        marks = ["present", "late", "absent: mc"]
+        calls = [(rng.choice(dates), q, rng.choice(marks)) for q in qs]
+        results.append(summary("update_attendance", timed(db.update_attendance, calls), **params))
+
+        date = dates[len(dates)//2]
+        for name in rng.sample([r[0] for r in loaded], min(len(loaded), samples//2)):
+            db.update_attendance(date, name, rng.choice(marks))
+        for mode, section in REPORTS:
+            def cold(): # a write to the session would invalidate it the same way
+                db.touch(algorithm.to_ordinal(date))
+                db.get_report(date, mode, section)
+            results.append(summary("get_report", timed(cold, [()]*samples), mode=mode, section=section, cached=False, **params))
+            results.append(summary("get_report", timed(db.get_report, [(date, mode, section)]*samples),
+                                   mode=mode, section=section, cached=True, **params))
+        results.append(summary("get_report", timed(lambda s: (db.touch(), db.get_section_members(s)), [("S",)]*samples),
+                               mode="section", section="S", cached=False, **params))
+
+        victims = rng.sample([r[0] for r in loaded], min(len(loaded), max(1, samples//10)))
+        results.append(summary("delete_member", timed(db.delete_member, [(v,) for v in victims]), **params))
+    except Exception as e:
+        results.append(failure("bench_db", e, **params))
+    finally:
+        db.close()
+    return results
+
+def compare(old, new):
+    """ Prints new/old mean ratios for results present in both runs """
+    def key(r): return tuple(sorted((k, v) for k, v in r.items()
+                                    if k not in ("calls", "mean_ms", "p50_ms", "max_ms", "error")))
+    before = {key(r): r for r in old["results"] if "mean_ms" in r}
+    for r in new["results"]:
+        b = before.get(key(r))
+        if b is None or "mean_ms" not in r: continue
+        label = " ".join("{}={}".format(k, v) for k, v in key(r) if k != "op")
+        print("{:20s} {:60s} {:10.3f}ms -> {:10.3f}ms  x{:.2f}"
+              .format(r["op"], label, b["mean_ms"], r["mean_ms"], r["mean_ms"]/b["mean_ms"] if b["mean_ms"] else 0))
+
+def commit_id():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(members, sessions, samples, seed=0, out=print):
+    results = []
+    for n in members:
+        rows = roster(n, seed)
+        results += bench_bktree(rows, samples, seed)
+        for s in sessions:
+            out("{} members, {} sessions".format(n, s))
+            results += bench_db(rows, s, samples, seed)
+    return {"commit": commit_id(), "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "members": members, "sessions": sessions, "samples": samples, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, nargs="+", default=[50, 500, 5000, 50000])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--samples", type=int, default=50, help="calls timed per op")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="scalability.json")
+    parser.add_argument("--compare", help="earlier results to compare against")
+    args = parser.parse_args()
+
+    report = run(args.members, args.sessions, args.samples, args.seed)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    for r in report["results"]:
+        label = " ".join("{}={}".format(k, r[k]) for k in ("members", "loaded", "sessions", "mode", "section", "cached") if k in r)
+        if "error" in r: print("{:20s} {:55s} {}".format(r["op"], label, r["error"]))
+        else: print("{:20s} {:55s} mean {:9.3f}ms  p50 {:9.3f}ms  max {:9.3f}ms"
+                    .format(r["op"], label, r["mean_ms"], r["p50_ms"], r["max_ms"]))
+    print("Written to", args.out)
+    if args.compare:
+        with open(args.compare) as f: compare(json.load(f), report)
+
+if __name__ == "__main__":
+    main()
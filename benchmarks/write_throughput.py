@@ -0,0 +1,55 @@
+# Write throughput of check-ins, rollback journal vs WAL with group commit.
+# /present writes straight away, /add looks up the session time first.
+# Usage: python benchmarks/write_throughput.py [members] [threads] [ops_per_thread]
+
+import os, sys; sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logic"))
+
+import tempfile
+import threading
+import time
+import algorithm
+
+CONFIGS = {
+    "before (rollback journal, commit per write)":
+        {"journal_mode": "DELETE", "synchronous": "FULL", "commit_window": 0},
+    "after (WAL, group commit)": {},
+}
+
+def run(config, members, threads, ops, add=False):
+    with tempfile.TemporaryDirectory() as d:
+        config = dict(config, path=os.path.join(d, "records.db"),
+                      aliases=os.path.join(d, "aliases.json"),
+                      journal=os.path.join(d, "journal.log"),
+                      snapshot=os.path.join(d, "snapshot.db"))
+        db = algorithm.DB(config)
+        for i in range(members):
+            db.add_member("member{}".format(i), "S1", "91234567", "active")
+        db.add_session("2018-09-13", "19:30", "practice")
+        db.flush()
+
+        def worker(t):
+            for k in range(ops):
+                name = "member{}".format((t*ops + k) % members)
+                if add: db.get_session_dt("2018-09-13") # /add picks present or late
+                db.set_present("2018-09-13", name)
+                if k % 10 == 0: db.get_full_report("2018-09-13") # readers in the mix
+
+        start = time.perf_counter()
+        pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+        for t in pool: t.start()
+        for t in pool: t.join()
+        db.flush()
+        elapsed = time.perf_counter() - start
+        db.close()
+    return threads*ops / elapsed
+
+def main():
+    args = [int(a) for a in sys.argv[1:4]]
+    members, threads, ops = args + [50, 8, 200][len(args):]
+    print("{} members, {} threads x {} writes".format(members, threads, ops))
+    for label, config in CONFIGS.items():
+        print("{:45s} {:10.0f} writes/s (/present) {:10.0f} writes/s (/add)"
+              .format(label, run(config, members, threads, ops), run(config, members, threads, ops, True)))
+
+if __name__ == "__main__":
+    main()
@@ -3,54 +3,275 @@
 import sqlite3
 import json
 import bktree
+from committer import committer
+from roster import Roster
+from journal import Journal
+from rendercache import report_cache
+from storage import Storage
 import os
 import datetime
+import itertools
+import threading
+from functools import lru_cache, wraps
+from contextlib import nullcontext, contextmanager
+
+DAYS = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+@lru_cache(maxsize=4096)
+def parse_date(date):
+    """ 2018-08-20 -> (2018, 8, 20) """
+    return tuple(map(int, date.split("-")))
+
+@lru_cache(maxsize=4096)
+def parse_time(time):
+    """ 19:47 -> (19, 47) """
+    return tuple(map(int, time.split(":")))
+
+# Sessions are stored as day ordinals (datetime.date.toordinal) and minutes
+# past midnight, so the DB only compares integers.
+
+def to_ordinal(date):
+    return date if type(date) is int else _date_ordinal(date)
+
+@lru_cache(maxsize=4096)
+def _date_ordinal(date):
+    return datetime.date(*parse_date(date)).toordinal()
+
+@lru_cache(maxsize=4096)
+def ordinal_to_date(ordinal):
+    return datetime.date.fromordinal(ordinal).isoformat()
+
+def to_minutes(time):
+    if type(time) is int: return time
+    h, m = parse_time(time)
+    return 60*h + m
+
+def minutes_to_time(minutes): return "{:02d}:{:02d}".format(*divmod(minutes, 60))
 
 class DT:
+    __slots__ = ("y", "m", "d", "h", "min")
+
     def __init__(self, *args):
         """ args == datetime obj / 2018-08-20 19:47 """
         if len(args) >= 1 and type(args[0]) is str:
             # Parse datestring 2018-08-20
-            self.y, self.m, self.d = list(map(int, args[0].split("-")))
+            self.y, self.m, self.d = parse_date(args[0])
             self.h, self.min = 0, 0
         if len(args) == 2 and type(args[1]) is str:
             # Parse timestring 19:47
-            self.h, self.min = list(map(int, args[1].split(":")))
+            self.h, self.min = parse_time(args[1])
         if len(args) == 1 and type(args[0]) is datetime.datetime:
             dt = args[0]
             self.y, self.m, self.d, self.h, self.min = dt.year, dt.month, dt.day, dt.hour, dt.minute
+
+    @classmethod
+    def from_ordinal(cls, ordinal, minutes=0):
+        dt = cls.__new__(cls)
+        date = datetime.date.fromordinal(ordinal)
+        dt.y, dt.m, dt.d = date.year, date.month, date.day
+        dt.h, dt.min = divmod(minutes, 60)
+        return dt
             
     def to_date(self): return "{:04d}-{:02d}-{:02d}".format(self.y, self.m, self.d)
     def to_time(self): return "{:02d}:{:02d}".format(self.h, self.min)
     def to_dt(self): return datetime.datetime(self.y, self.m, self.d, self.h, self.min)
-    def day_of_week(self):
-        t = [0,3,2,5,0,3,5,1,4,6,2,4]
-        y = self.y - (self.m < 3)
-        idx = (y + y//4 - y//100 + y//400 + t[self.m-1] + self.d) % 7
-        return ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday",
-                "Friday", "Saturday"][idx]
+    def to_ordinal(self): return datetime.date(self.y, self.m, self.d).toordinal()
+    def to_minutes(self): return 60*self.h + self.min
+    def day_of_week(self): return DAYS[self.to_ordinal() % 7] # ordinal 1 is a Monday
+
+def quote(name):
+    """ SQL identifier for a member column """
+    return '"{}"'.format(name.replace('"', '""'))
+
+def synchronized(f):
+    """ Serialises access to the shared connection, cursor and alias index """
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return f(self, *args, **kwargs)
+    return wrapper
+
+def reading(f):
+    """ Reads run lock-free on per-thread connections, except in memory
+    where the writer connection is the only one """
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self.read_lock:
+            return f(self, *args, **kwargs)
+    return wrapper
+
+def journaled(f):
+    """ Logs the outermost mutation in the journal with the calls that revert it.
+    The event is appended by commit(), so failed attempts are not logged,
+    and the savepoint takes back whatever SQL they already ran. """
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            if self.journal_depth: return f(self, *args, **kwargs) # nested or replayed
+            undo = getattr(self, "_undo_" + f.__name__)(*args, **kwargs)
+            self.pending_event = (f.__name__, args, kwargs, undo)
+            self.journal_depth += 1
+            try:
+                with self.savepoint():
+                    return f(self, *args, **kwargs)
+            finally:
+                self.journal_depth -= 1
+                self.pending_event = None
+    return wrapper
 
 # only usable for backend testing
 def confirm_delete():
     return input("WARNING! Deleting data... Type 'deleteme' to confirm: ") == "deleteme"
 
-class DB:
-    def __init__(self):
+# Storage engine settings, override per DB with DB(config)
+DEFAULT_CONFIG = {
+    "path": "records.db",
+    "aliases": "aliases.json",
+    "journal_mode": "WAL",    # readers and the writer do not block each other
+    "synchronous": "NORMAL",  # with WAL, only checkpoints fsync
+    "cache_size": -8000,      # negative is in KiB
+    "commit_window": 0.05,    # seconds to batch mutations per commit, 0 commits each
+    "journal": "journal.log", # append-only event log
+    "snapshot": "snapshot.db",
+    "snapshot_every": 500,    # events between snapshots
+    "journal_keep": 100,      # events kept after a snapshot, for /undo
+}
+
+class DB(Storage):
+    epochs = itertools.count()
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.lock = threading.RLock()
+        self.memory = self.config["path"] == ":memory:"
+        self.read_lock = self.lock if self.memory else nullcontext()
+        self.dirty = False
+        self.readers = threading.local()
+        self.reader_conns = []
+        self.journal = Journal(self.config["journal"])
+        self.journal_depth = 0
+        self.pending_event = None
+        self.savepoints = 0
         self.restart()
 
+    def connect(self):
+        conn = sqlite3.connect(self.config["path"], detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False, timeout=10)
+        conn.execute("PRAGMA journal_mode={}".format(self.config["journal_mode"]))
+        conn.execute("PRAGMA synchronous={}".format(self.config["synchronous"]))
+        conn.execute("PRAGMA cache_size={}".format(int(self.config["cache_size"])))
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    @synchronized
     def restart(self):
         if not hasattr(self, "conn"):
-            self.conn = sqlite3.connect("records.db", detect_types=sqlite3.PARSE_DECLTYPES)
+            self.restore()
+            self.conn = self.connect() # writer, guarded by self.lock
             self.c = self.conn.cursor()
         self.initialise()
-        with open("aliases.json", "r") as f:
-            self.aliases = json.load(f) # alias-name pairs     
-        self.alias_bktree = bktree.build(self.aliases.keys())
+        self.roster = None
+        # Report cache keys start with the epoch, unique to this open DB even
+        # in memory, and entries are only served at the data versions below
+        self.epoch = next(DB.epochs)
+        self.roster_version = 0
+        self.session_versions = {} # day ordinal -> version
+        self.aliases = {} # alias-name pairs, only kept in RAM if config["aliases"] is None
+        if self.config["aliases"]:
+            with open(self.config["aliases"], "r") as f:
+                self.aliases = json.load(f)
+        self.rebuild_index()
+        self.recover()
+
+    def touch(self, day=None):
+        """ Bumps the data version of a session, or of the roster (all sessions).
+        Called after commit() so readers that see the new version also see the data. """
+        if day is None: self.roster_version += 1
+        else: self.session_versions[day] = self.session_versions.get(day, 0) + 1
+
+    def rebuild_index(self):
+        """ Drops the alias index, it is built again on first use or by warm() """
+        self.alias_index = None
+
+    @property
+    def alias_bktree(self):
+        """ Alias index, only touched with self.lock held """
+        if self.alias_index is None: self.alias_index = bktree.build(self.aliases.keys())
+        return self.alias_index
+
+    @synchronized
+    def warm(self):
+        """ Builds what opening the DB left for first use, e.g. from a background thread """
+        self.alias_bktree
+        self.get_roster()
 
     def commit(self):
+        """ Queues a group commit, or commits now if batching is disabled """
+        if self.pending_event is not None:
+            # Journal first; meta.seq lands in the same transaction as the change
+            event = self.journal.append(*self.pending_event)
+            self.pending_event = None
+            self.c.execute("UPDATE meta SET value=? WHERE key='seq'", (event["seq"],))
+        self.dirty = True
+        if self.config["commit_window"] > 0:
+            committer.schedule(self, self.config["commit_window"])
+        elif not self.savepoints:
+            self.flush()
+
+    @contextmanager
+    def savepoint(self):
+        """ All or none of the statements inside reach the next commit, without
+        rolling back other mutations batched in the same transaction.
+        Flushes wait until the outermost savepoint is released. """
+        if not self.conn.in_transaction: self.c.execute("BEGIN")
+        self.c.execute("SAVEPOINT mutation")
+        self.savepoints += 1
+        try:
+            yield
+        except BaseException:
+            self.c.execute("ROLLBACK TO mutation")
+            self.c.execute("RELEASE mutation")
+            self.roster = None
+            raise
+        else:
+            self.c.execute("RELEASE mutation")
+        finally:
+            self.savepoints -= 1
+        if self.dirty and self.config["commit_window"] <= 0: self.flush()
+
+    @synchronized
+    def flush(self):
+        if not self.dirty or self.savepoints: return
+        # Aliases go first: replaying the journal tail over them is harmless
+        if self.config["aliases"]:
+            with open(self.config["aliases"], "w") as f:
+                json.dump(self.aliases, f)
+        self.journal.sync()
         self.conn.commit()
-        with open("aliases.json", "w") as f:
-            json.dump(self.aliases, f)
+        self.dirty = False
+        if self.journal.since_snapshot >= self.config["snapshot_every"]:
+            self.snapshot()
+
+    def reader(self):
+        """ Cursor on this thread's own read connection, sees all prior commits """
+        if self.memory: return self.conn.cursor() # under read_lock
+        if self.dirty: self.flush()
+        conn = getattr(self.readers, "conn", None)
+        if conn is None:
+            conn = self.readers.conn = self.connect()
+            with self.lock: self.reader_conns.append(conn)
+        return conn.cursor()
+
+    @synchronized
+    def close(self):
+        committer.cancel(self)
+        self.flush()
+        for conn in self.reader_conns: conn.close()
+        self.reader_conns = []
+        self.readers = threading.local()
+        self.conn.close()
+        del self.conn
+        self.journal.close()
 
     def initialise(self):
         self.c.execute(""" CREATE TABLE IF NOT EXISTS details
@@ -60,61 +281,94 @@ class DB:
                             contact INTEGER,
                             status TEXT) """)
         self.c.execute(""" CREATE TABLE IF NOT EXISTS attendance
-                           (date TEXT,
-                            time TEXT,
+                           (date INTEGER,
+                            time INTEGER,
                             sessiontype TEXT) """)
-        if not os.path.isfile("aliases.json"):
-            with open("aliases.json", "w") as f:
+        columns = self.c.execute("PRAGMA table_info(attendance)").fetchall()
+        if columns[0][2] == "TEXT":
+            # Migrate 'YYYY-MM-DD' and 'HH:MM' strings to day ordinals and minutes
+            date = "CAST(julianday(date) - 1721424.5 AS INTEGER)"
+            time = "CAST(substr(time, 1, instr(time, ':')-1) AS INTEGER)*60"\
+                   " + CAST(substr(time, instr(time, ':')+1) AS INTEGER)"
+            members = [(c[1], c[2]) for c in columns[3:]]
+            self.rebuild_attendance([("date", "INTEGER"), ("time", "INTEGER"), ("sessiontype", "TEXT")] + members,
+                                    [date, time, "sessiontype"] + [quote(n) for n, _ in members])
+        self.c.execute("CREATE UNIQUE INDEX IF NOT EXISTS attendance_date ON attendance(date)")
+        self.c.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self.c.execute("INSERT OR IGNORE INTO meta VALUES ('seq', 0)") # last journal event applied
+        self.conn.commit()
+        if self.config["aliases"] and not os.path.isfile(self.config["aliases"]):
+            with open(self.config["aliases"], "w") as f:
                 json.dump({}, f)
 
+    @synchronized
     def hard_reset(self):
         assert confirm_delete()
         self.c.execute("DROP TABLE IF EXISTS details")
         self.c.execute("DROP TABLE IF EXISTS attendance")
-        if os.path.isfile("aliases.json"):
-            os.remove("aliases.json")
+        if self.config["aliases"] and os.path.isfile(self.config["aliases"]):
+            os.remove(self.config["aliases"])
+        if self.config["snapshot"] and os.path.isfile(self.config["snapshot"]):
+            os.remove(self.config["snapshot"])
+        self.journal.compact(self.journal.seq)
         self.initialise()
         self.restart()
 
 
     ### EDITING TOOLS ###
         
+    @journaled
     def add_member(self, name, section, contact, status, *aliases):
         """ Add new member to database. """
         # Check duplicate names
-        self.c.execute("SELECT * FROM details WHERE name=?", (name,))
-        if self.c.fetchone() is not None:
+        if name in self.get_roster().members:
             return "{} already exists.".format(name)
+        try:
+            # One column per member, SQLite caps a table at 2000 columns by default
+            self.c.execute("ALTER TABLE attendance ADD COLUMN {} TEXT".format(quote(name)))
+        except sqlite3.OperationalError as e:
+            raise AssertionError("Cannot add {}: {}.".format(name, e))
         self.c.execute(""" INSERT INTO details (name, section, contact, status)
                            VALUES (?,?,?,?) """, (name, section.upper(), contact, status))
-        self.c.execute("ALTER TABLE attendance ADD COLUMN '{}' TEXT".format(name))
+        self.roster = None
 
         # Assign aliases to name -- including a default alias
         self.__create_new_alias(name, name)
         for alias in aliases: self.__create_new_alias(name, alias)
         self.commit()
+        self.touch()
         return "{} added.".format(name)
 
+    @journaled
     def update_member(self, name, **info):
-        att_headers = self.get_table_headers("attendance")
-        if name not in att_headers:
+        members = self.get_roster().members
+        if name not in members:
             return "{} not found.".format(name)
+        if "rename" in info and info["rename"] in members:
+            return "{} already exists.".format(info["rename"])
         
         if "rename" in info:
             self.c.execute("UPDATE details SET name=? WHERE name=?", (info["rename"], name))
+            self.c.execute("ALTER TABLE attendance RENAME COLUMN {} TO {}".format(quote(name), quote(info["rename"])))
         if "section" in info:
             self.c.execute("UPDATE details SET section=? WHERE name=?", (info["section"], name))
         if "contact" in info:
             self.c.execute("UPDATE details SET contact=? WHERE name=?", (info["contact"], name))
         if "status" in info:
             self.c.execute("UPDATE details SET status=? WHERE name=?", (info["status"], name))
+        self.roster = None
         self.commit()
+        self.touch()
         return "{} updated.".format(name)
 
     def update_status(self, name, status): return self.update_member(name, status=status)
     def update_contact(self, name, contact): return self.update_member(name, contact=contact)
     def update_section(self, name, section): return self.update_member(name, section=section.upper())
+    @journaled
     def update_name(self, name, rename, *aliases):
+        members = self.get_roster().members
+        if name not in members or rename in members:
+            return self.update_member(name, rename=rename) # refuses, aliases stay
         r = self.update_member(name, rename=rename)
         
         # Remove existing alias listings
@@ -127,57 +381,58 @@ class DB:
         self.__create_new_alias(name, name)
         for alias in aliases: self.__create_new_alias(name, alias)
         self.commit()
-        self.restart()
+        self.rebuild_index()
         return r
 
+    @journaled
     def delete_member(self, name):
-        att_headers = self.get_table_headers("attendance")
-        if name not in att_headers:
+        if name not in self.get_roster().members: # not a session column either
             return "{} not found.".format(name)
 
         # Remove from attendance table (col)
-        att_headers.remove(name)
-        att_args = str(att_headers)[1:-1] # Argument form
-        self.c.execute("CREATE TEMPORARY TABLE attendance_backup({})".format(att_args))
-        self.c.execute("INSERT INTO attendance_backup SELECT {} FROM attendance".format(att_args))
-        self.c.execute("DROP TABLE attendance")
-        self.c.execute("CREATE TABLE attendance({})".format(att_args))
-        self.c.execute("INSERT INTO attendance SELECT {} FROM attendance_backup".format(att_args))
-        self.c.execute("DROP TABLE attendance_backup")
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            self.c.execute("ALTER TABLE attendance DROP COLUMN {}".format(quote(name)))
+        else:
+            columns = self.c.execute("PRAGMA table_info(attendance)").fetchall()
+            self.rebuild_attendance([(c[1], c[2]) for c in columns if c[1] != name])
 
         # Remove from details table (row)
-        self.c.execute("DELETE FROM details WHERE name='{}'".format(name))
+        self.c.execute("DELETE FROM details WHERE name=?", (name,))
+        self.roster = None
 
         # Remove from alias data
         for key in list(self.aliases.keys()):
             if self.aliases[key] == name:
                 del self.aliases[key]
         self.commit()
-        self.restart()
+        self.touch()
+        self.rebuild_index()
         return "{} deleted.".format(name)
     
     def __create_new_alias(self, name, *aliases):
         for alias in aliases:
             alias = alias.replace(" ", "").lower()
             self.aliases[alias] = name
-            self.alias_bktree.add(alias)
+            if self.alias_index is not None: self.alias_index.add(alias)
 
+    @journaled
     def add_alias(self, target, *aliases):
         # TODO: Check if target is existing alias to name
         name = self.match_alias_to_name(target)
         if name == "":
-            return "{} cannot be found.".format(alias)
+            return "{} cannot be found.".format(target)
         self.__create_new_alias(name, *aliases)
         self.commit()
-        self.restart()
+        self.rebuild_index()
         return "Aliases {} added for {}.".format(aliases, name)
             
+    @journaled
     def delete_alias(self, alias):
         alias = alias.replace(" ", "").lower()
         if alias in self.aliases:
             del self.aliases[alias]
             self.commit()
-            self.restart() # Simple BKTree initialisation
+            self.rebuild_index() # Simple BKTree initialisation
             return "{} deleted.".format(alias)
         else:
             return "{} not found.".format(alias)
@@ -186,89 +441,118 @@ class DB:
 
     ### PRACTICES ###
 
+    @journaled
     def add_session(self, date, time, sessiontype):
-        date = DT(date).to_date() # reparse
+        day = to_ordinal(date)
         # Works on assumption of only one practice session per day
-        self.c.execute("SELECT * FROM attendance WHERE date=?", (date,))
+        self.c.execute("SELECT 1 FROM attendance WHERE date=?", (day,))
         if self.c.fetchone() is not None:
-            return "{} practice already exists.".format(date)
+            return "{} practice already exists.".format(ordinal_to_date(day))
         self.c.execute("INSERT INTO attendance (date, time, sessiontype) VALUES (?,?,?)",
-                        (date, time, sessiontype))
+                        (day, to_minutes(time), sessiontype))
         self.commit()
-        return "{} {} {} practice created.".format(date, time, sessiontype)
+        self.touch(day)
+        return "{} {} {} practice created.".format(ordinal_to_date(day), time, sessiontype)
 
+    @journaled
     def delete_session(self, date):
-        date = DT(date).to_date() # reparse
-        self.c.execute("SELECT * FROM attendance WHERE date=?", (date,))
+        day = to_ordinal(date)
+        self.c.execute("SELECT 1 FROM attendance WHERE date=?", (day,))
         if self.c.fetchone() is None:
-            return "{} practice not found.".format(date)
-        self.c.execute("DELETE FROM attendance WHERE date=?", (date,))
+            return "{} practice not found.".format(ordinal_to_date(day))
+        self.c.execute("DELETE FROM attendance WHERE date=?", (day,))
         self.commit()
-        return "{} practice deleted.".format(date)
+        self.touch(day)
+        return "{} practice deleted.".format(ordinal_to_date(day))
+
+    # Session lookups guard check-ins (/add), so they read on the writer
+    # connection: a reader would flush the batched writes before every check-in
 
+    @synchronized
     def get_session_time(self, date): # Not used
-        date = DT(date).to_date() # reparse
-        self.c.execute("SELECT time FROM attendance WHERE date=?", (date,))
+        self.c.execute("SELECT time FROM attendance WHERE date=?", (to_ordinal(date),))
         time_ary = self.c.fetchone()
         if time_ary is None:
             return "00:00"
             return "{} practice does not exist.".format(date)
-        return time_ary[0]
+        return minutes_to_time(time_ary[0])
 
+    @synchronized
     def get_session_dt(self, date): # Watch out for difference in outputs
-        date = DT(date).to_date() # reparse
-        self.c.execute("SELECT time FROM attendance WHERE date=?", (date,))
+        day = to_ordinal(date)
+        self.c.execute("SELECT time FROM attendance WHERE date=?", (day,))
         time_ary = self.c.fetchone()
         if time_ary is None:
-            return DT(date).to_dt()
+            return datetime.datetime.fromordinal(day)
             return "{} practice does not exist!"
-        return DT(date, time_ary[0]).to_dt()
+        return datetime.datetime.fromordinal(day) + datetime.timedelta(minutes=time_ary[0])
+
+    @reading
+    def get_sessions(self, start):
+        """ Returns [(date, time), ...] of sessions on or after start """
+        cur = self.reader()
+        cur.execute("SELECT date, time FROM attendance WHERE date>=? ORDER BY date",
+                    (to_ordinal(start),))
+        return [(ordinal_to_date(d), minutes_to_time(t)) for d, t in cur.fetchall()]
 
 
     ### UPDATE ATTENDANCE ###
 
+    @synchronized
     def update_attendance(self, date, alias, text):
-        date = DT(date).to_date() # reparse
         name = self.match_alias_to_name(alias)
         if name == "":
             return "{} not found.".format(alias)
-        self.c.execute("SELECT * FROM attendance WHERE date=?", (date,))
+        return self.mark_attendance(date, name, text)
+
+    @journaled
+    def mark_attendance(self, date, name, text):
+        """ update_attendance once the alias is resolved, logged and undone by name """
+        day = to_ordinal(date)
+        self.c.execute("SELECT {} FROM attendance WHERE date=?".format(quote(name)), (day,))
         if self.c.fetchone() is None:
-            return "{} practice not found.".format(date)
-        self.c.execute("UPDATE attendance SET '{}'='{}' WHERE date='{}'".format(name, text, date))
+            return "{} practice not found.".format(ordinal_to_date(day))
+        self.c.execute("UPDATE attendance SET {}=? WHERE date=?".format(quote(name)), (text, day))
         self.commit()
+        self.touch(day)
         return "{} marked as {}.".format(name, text)
 
     def set_present(self, date, alias):
-        date = DT(date).to_date() # reparse
         return self.update_attendance(date, alias, "present")
 
     def set_late(self, date, alias, reason=""):
-        date = DT(date).to_date() # reparse
         text = "late" if reason == "" else ("late: " + reason)
         return self.update_attendance(date, alias, text)
 
     def set_absent(self, date, alias, reason=""):
-        date = DT(date).to_date() # reparse
         text = "absent" if reason == "" else ("absent: " + reason)
         return self.update_attendance(date, alias, text)
 
+    @journaled
     def set_absent_all(self, date):
-        date = DT(date).to_date() # reparse
-        self.c.execute("SELECT * FROM attendance WHERE date=?", (date,))
+        day = to_ordinal(date)
+        self.c.execute("SELECT 1 FROM attendance WHERE date=?", (day,))
         if self.c.fetchone() is None:
-            return "{} practice not found.".format(date)
-        for member in list(self.get_not_present_report(date).keys()):
-            self.c.execute("UPDATE attendance SET '{}'='absent' WHERE date='{}'".format(member, date))
+            return "{} practice not found.".format(ordinal_to_date(day))
+        members = self.get_table_headers("attendance")[3:]
+        if members:
+            # One statement for everyone not yet marked
+            marks = ", ".join("{0}=COALESCE({0}, 'absent')".format(quote(m)) for m in members)
+            self.c.execute("UPDATE attendance SET {} WHERE date=?".format(marks), (day,))
         self.commit()
-        return "Absence marked for {} practice.".format(date)
+        self.touch(day)
+        return "Absence marked for {} practice.".format(ordinal_to_date(day))
 
 
     ### GENERATE ATTENDANCE OVERVIEW ###
 
     def get_section_members(self, section):
-        self.c.execute("SELECT name FROM details WHERE section LIKE '{}%'".format(section.upper()))
-        return str(list(map(lambda x: x[0], self.c.fetchall())))
+        key, version = (self.epoch, None, section.upper(), "section"), self.roster_version
+        cached = report_cache.get(key, version)
+        if cached is not None: return cached
+        text = str(self.get_roster().section_members(section))
+        report_cache.put(key, version, text)
+        return text
 
     def get_no_reason_report(self, date, section="."):
         return self.get_report(date, "reason", section)
@@ -280,18 +564,28 @@ class DB:
         return self.get_report(date, "full", section)
         
     def get_report(self, date, mode="full", section="."):
-        date = DT(date).to_date() # reparse
-        self.c.execute("SELECT * FROM attendance WHERE date=?", (date,))
-        att_result = self.c.fetchone()
+        day = to_ordinal(date)
+        key = (self.epoch, day, section.upper(), mode)
+        version = (self.roster_version, self.session_versions.get(day, 0))
+        cached = report_cache.get(key, version)
+        if cached is None:
+            cached = self.render_report(day, mode, section)
+            report_cache.put(key, version, cached)
+        return cached
+
+    @reading
+    def render_report(self, day, mode, section):
+        cur = self.reader()
+        cur.execute("SELECT * FROM attendance WHERE date=?", (day,))
+        att_result = cur.fetchone()
         if att_result is None:
-            return "{} practice not found.".format(date)
-        att_namelist = self.get_table_headers("attendance")
+            return "{} practice not found.".format(ordinal_to_date(day))
+        att_namelist = list(next(zip(*cur.description)))
 
         att_list = {}
-        if section != ".":
-            section_members = self.get_list_of_section_members(section)
+        roster = self.get_roster()
         for i in range(3, len(att_result)):
-            if section != "." and att_namelist[i] not in section_members: continue
+            if section != "." and not roster.in_section(att_namelist[i], section): continue
             if mode == "absent" and att_result[i] != None: continue
             if mode == "reason" and att_result[i] not in ("late", "absent"): continue
             att_list[att_namelist[i]] = att_result[i]
@@ -308,6 +602,7 @@ class DB:
         if query in self.aliases: return [query]
         return self.alias_bktree.search(query)
     
+    @synchronized
     def match_alias_to_name(self, query):
         """ Returns a string representing name """
         candidates = self.__match_alias(query)
@@ -318,30 +613,233 @@ class DB:
         return "" # Failed to match unique
     
 
+    ### JOURNAL ###
+
+    def apply(self, op, args, kwargs=None):
+        """ Re-runs a logged call, callers suppress logging via journal_depth """
+        if op == "undo":
+            for call in args[1]: self.apply(*call)
+        else:
+            getattr(self, op)(*args, **(kwargs or {}))
+
+    def recover(self):
+        """ Replays journal events the tables have not seen yet, e.g. after a crash """
+        seq = self.c.execute("SELECT value FROM meta WHERE key='seq'").fetchone()[0]
+        self.journal.seq = max(self.journal.seq, seq)
+        tail = self.journal.tail(seq)
+        if not tail: return
+        self.journal_depth += 1
+        try:
+            for event in tail:
+                self.apply(event["op"], event["args"], event["kwargs"])
+                self.c.execute("UPDATE meta SET value=? WHERE key='seq'", (event["seq"],))
+        finally:
+            self.journal_depth -= 1
+        self.dirty = True
+        self.flush()
+
+    def last_undoable(self):
+        return self.journal.last_undoable()
+
+    @synchronized
+    def undo(self):
+        event = self.journal.last_undoable()
+        if event is None: return "Nothing to undo."
+        if event["undo"] is None: return "Last change cannot be undone."
+        self.pending_event = ("undo", [event["seq"], event["undo"]], {}, None)
+        self.journal_depth += 1
+        try:
+            with self.savepoint():
+                for call in event["undo"]: self.apply(*call)
+                if self.pending_event is not None: self.commit() # mark undone even if a no-op
+        finally:
+            self.journal_depth -= 1
+            self.pending_event = None
+        return "Undid `{} {}`.".format(event["op"], " ".join(map(str, event["args"])))
+
+    @synchronized
+    def snapshot(self, path=None):
+        """ Copies tables and aliases to path, by default the snapshot file,
+        which also lets the journal drop events up to here """
+        path = path or self.config["snapshot"]
+        if not path:
+            # Nothing to recover from, just bound the in-memory journal
+            self.journal.compact(self.journal.seq - self.config["journal_keep"])
+            return
+        self.flush()
+        target = sqlite3.connect(path)
+        self.conn.backup(target)
+        target.execute("INSERT OR REPLACE INTO meta VALUES ('aliases', ?)", (json.dumps(self.aliases),))
+        target.commit()
+        target.close()
+        if path == self.config["snapshot"]:
+            self.journal.compact(self.journal.seq - self.config["journal_keep"])
+
+    def replicate(self, path):
+        """ Backs up this tenant's current state to path """
+        self.snapshot(path)
+
+    def restore(self):
+        """ Recreates a missing records.db from the latest snapshot, recover() replays the rest """
+        path, snapshot = self.config["path"], self.config["snapshot"]
+        if os.path.exists(path) or not snapshot or not os.path.isfile(snapshot): return
+        source, target = sqlite3.connect(snapshot), sqlite3.connect(path)
+        source.backup(target)
+        aliases = target.execute("SELECT value FROM meta WHERE key='aliases'").fetchone()
+        target.execute("DELETE FROM meta WHERE key='aliases'")
+        target.commit()
+        source.close()
+        target.close()
+        if aliases is not None and self.config["aliases"]:
+            with open(self.config["aliases"], "w") as f:
+                f.write(aliases[0])
+
+    # Each _undo_<op> returns the calls that revert <op>, computed before it runs
+
+    def _undo_add_member(self, name, *args): return [["delete_member", [name]]]
+
+    def _undo_update_member(self, name, **info):
+        member = self.get_roster().members.get(name)
+        if member is None: return None
+        old = {k: getattr(member, k) for k in ("section", "contact", "status") if k in info}
+        if "rename" in info: return [["update_member", [info["rename"]], dict(old, rename=name)]]
+        return [["update_member", [name], old]]
+
+    def _undo_update_name(self, name, rename, *aliases):
+        return [["update_name", [rename, name] + [a for a, n in self.aliases.items() if n == name]]]
+
+    def _undo_delete_member(self, name):
+        member = self.get_roster().members.get(name)
+        if member is None: return None
+        aliases = [a for a, n in self.aliases.items() if n == name]
+        calls = [["add_member", [name, member.section, member.contact, member.status] + aliases]]
+        self.c.execute("SELECT date, {0} FROM attendance WHERE {0} IS NOT NULL".format(quote(name)))
+        return calls + [["mark_attendance", [day, name, text]] for day, text in self.c.fetchall()]
+
+    def _undo_add_alias(self, target, *aliases):
+        calls = []
+        for alias in aliases:
+            alias = alias.replace(" ", "").lower()
+            if alias in self.aliases: calls.append(["add_alias", [self.aliases[alias], alias]])
+            else: calls.append(["delete_alias", [alias]])
+        return calls
+
+    def _undo_delete_alias(self, alias):
+        alias = alias.replace(" ", "").lower()
+        if alias not in self.aliases: return None
+        return [["add_alias", [self.aliases[alias], alias]]]
+
+    def _undo_add_session(self, date, *args): return [["delete_session", [to_ordinal(date)]]]
+
+    def _undo_delete_session(self, date):
+        day = to_ordinal(date)
+        self.c.execute("SELECT * FROM attendance WHERE date=?", (day,))
+        row = self.c.fetchone()
+        if row is None: return None
+        names = [d[0] for d in self.c.description]
+        calls = [["add_session", [day, row[1], row[2]]]]
+        return calls + [["mark_attendance", [day, n, v]] for n, v in zip(names[3:], row[3:]) if v is not None]
+
+    def _undo_mark_attendance(self, date, name, text):
+        day = to_ordinal(date)
+        self.c.execute("SELECT {} FROM attendance WHERE date=?".format(quote(name)), (day,))
+        row = self.c.fetchone()
+        if row is None: return None
+        return [["mark_attendance", [day, name, row[0]]]]
+
+    def _undo_set_absent_all(self, date):
+        day = to_ordinal(date)
+        self.c.execute("SELECT * FROM attendance WHERE date=?", (day,))
+        row = self.c.fetchone()
+        if row is None: return None
+        names = [d[0] for d in self.c.description]
+        return [["mark_attendance", [day, n, None]] for n, v in zip(names[3:], row[3:]) if v is None]
+
+
     ### TOOLS ###
 
+    def rebuild_attendance(self, columns, exprs=None):
+        """ Recreates attendance with typed columns [(name, type)],
+        filled from exprs over the old table (default: same columns) """
+        names = [quote(n) for n, _ in columns]
+        self.c.execute("DROP TABLE IF EXISTS attendance_new")
+        self.c.execute("CREATE TABLE attendance_new ({})".format(
+            ", ".join("{} {}".format(n, t) for n, (_, t) in zip(names, columns))))
+        self.c.execute("INSERT INTO attendance_new SELECT {} FROM attendance".format(", ".join(exprs or names)))
+        self.c.execute("DROP TABLE attendance")
+        self.c.execute("ALTER TABLE attendance_new RENAME TO attendance")
+        self.c.execute("CREATE UNIQUE INDEX IF NOT EXISTS attendance_date ON attendance(date)")
+
+    @synchronized
+    def get_roster(self):
+        """ Cached details table, dropped by every write to it """
+        if self.roster is None:
+            self.c.execute("SELECT id, name, section, contact, status FROM details ORDER BY id")
+            self.roster = Roster(self.c.fetchall())
+        return self.roster
+
+    @synchronized
     def get_table_headers(self, database):
         self.c.execute("SELECT * FROM {}".format(database))
         return list(next(zip(*self.c.description)))
         
+    @synchronized
+    def table_rows(self, database):
+        """ Headers then rows, attendance with its dates and times written out """
+        self.c.execute("SELECT * FROM {}".format(database))
+        rows = [next(zip(*self.c.description))]
+        for row in self.c.fetchall():
+            if database == "attendance": row = (ordinal_to_date(row[0]), minutes_to_time(row[1])) + row[2:]
+            rows.append(row)
+        return rows
+
+    @synchronized
     def print(self, database=None):
         if database in ("details", "attendance"):
-            self.c.execute("SELECT * FROM {}".format(database))
-            print(next(zip(*self.c.description)))
-            for row in self.c: print(row)
+            for row in self.table_rows(database): print(row)
         elif database == "alias":
             print(self.aliases)
         else:
             result = "--------------------\n"
             for database in ("details", "attendance"):
-                self.c.execute("SELECT * FROM {}".format(database))
-                result += str(next(zip(*self.c.description))) + "\n"
-                for row in self.c: result += str(row) + "\n"
+                for row in self.table_rows(database): result += str(row) + "\n"
                 result += "\n"
             result += str(self.aliases) + "\n"
             result += "--------------------"
         return result
                        
 
+# Throwaway DB for tests and benchmarks, nothing touches the filesystem
+MEMORY_CONFIG = {
+    "path": ":memory:",
+    "aliases": None,
+    "journal": None,
+    "snapshot": None,
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "commit_window": 0,
+}
+
+def read_sessions(path, start):
+    """ Sessions on or after start straight from a records.db, as get_sessions
+    would return them, without DB()'s migrations and journal replay.
+    None if the file still needs migrating, [] if there is none. """
+    if not os.path.isfile(path): return []
+    conn = sqlite3.connect(path, timeout=10)
+    try:
+        conn.execute("PRAGMA query_only=ON")
+        columns = conn.execute("PRAGMA table_info(attendance)").fetchall()
+        if not columns: return []
+        if columns[0][2] == "TEXT": return None
+        rows = conn.execute("SELECT date, time FROM attendance WHERE date>=? ORDER BY date",
+                            (to_ordinal(start),)).fetchall()
+    finally:
+        conn.close()
+    return [(ordinal_to_date(d), minutes_to_time(t)) for d, t in rows]
+
+class MemoryDB(DB):
+    def __init__(self, config=None):
+        DB.__init__(self, dict(MEMORY_CONFIG, **(config or {})))
+
 if __name__ == "__main__":
     db = DB()
@@ -13,22 +13,37 @@ def count_optional_args(inputs):
     if s == -1 or e == -1: return 0
     return len(inputs[s:e].split(",")) - 1
 
+class ArgSpec:
+    """ Usage string compiled once into argument counts,
+    e.g. "member <fullname> <section> <contact> <status>[,*<alias>]" """
+    __slots__ = ("inputs", "argc", "op_argc", "defaults")
+
+    def __init__(self, inputs):
+        assert type(inputs) is str
+        self.inputs = inputs
+        tokens = inputs.split("[")[0].split()
+        self.argc = len(tokens)
+        self.op_argc = count_optional_args(inputs)
+        self.defaults = sum(1 for t in tokens if "=" in t) # e.g. <section=.>
+
+    def check(self, cmd, args):
+        argc, op_argc, n = self.argc, self.op_argc, len(args)
+        if op_argc == -1:
+            assert n >= argc - self.defaults,\
+                   "Expected at least {} entries instead of {},\nFormat: `/{} {}`"\
+                   .format(argc, n, cmd, self.inputs)
+        elif op_argc == 0:
+            assert argc - self.defaults <= n <= argc,\
+                   "Expected {} entries instead of {},\nFormat: `/{} {}`"\
+                   .format(argc, n, cmd, self.inputs)
+        else:
+            assert argc - self.defaults <= n <= argc + op_argc,\
+                   "Expected {} entries instead of {},\nFormat: `/{} {}`"\
+                   .format(argc if argc > n else argc + op_argc, n, cmd, self.inputs)
+
 def assert_cmd(cmd, inputs, *args):
-    assert type(inputs) is str
-    argc = len(inputs.split(" ")) # e.g. inputs = "member fullname section contact status[,*nicknames]"
-    op_argc = count_optional_args(inputs)
-    if op_argc == -1:
-        assert len(args) >= argc,\
-               "Expected at least {} entries instead of {},\nFormat: `/{} {}`"\
-               .format(argc, len(args), cmd, inputs)
-    elif op_argc == 0:
-        assert len(args) == argc,\
-               "Expected {} entries instead of {},\nFormat: `/{} {}`"\
-               .format(argc, len(args), cmd, inputs)
-    else:
-        assert len(args) in (argc, argc + op_argc),\
-               "Expected {} entries instead of {},\nFormat: `/{} {}`"\
-               .format(argc if argc > len(args) else argc + op_argc, len(args), cmd, inputs)
+    if type(inputs) is str: inputs = ArgSpec(inputs)
+    inputs.check(cmd, args)
 
 # Member information
 
@@ -0,0 +1,105 @@
+import datetime
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+class Chat:
+    """ Per-chat state handed to every command.
+    The tenant's DB is only leased when a command touches it, from the
+    TenantPool that pool() returns at that time. """
+    __slots__ = ("chat_id", "tenant", "pool", "last_seen", "_date", "_db", "_leased")
+
+    def __init__(self, chat_id, tenant, pool):
+        self.chat_id = chat_id
+        self.tenant = tenant
+        self.pool = pool
+        self.last_seen = 0
+        self._date = None # set by /set, otherwise today
+        self._db = None
+        self._leased = None # the pool _db came from
+
+    @property
+    def cur_date(self):
+        return self._date or datetime.date.today().isoformat()
+
+    @cur_date.setter
+    def cur_date(self, date):
+        self._date = date
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._leased = self.pool()
+            self._db = self._leased.acquire(self.tenant)
+        return self._db
+
+    def release(self):
+        """ Returns the DB lease, called after each message """
+        if self._db is not None:
+            self._db = None
+            self._leased.release(self.tenant)
+
+class ChatRegistry:
+    """ Chats by id, least recently seen first. A chat idle for longer than
+    ttl seconds, or pushed out beyond capacity, is forgotten and starts
+    afresh on its next message. save() keeps last_seen and /set dates in
+    path across restarts. factory(chat_id) makes a new Chat. """
+
+    def __init__(self, factory, capacity=10000, ttl=30*86400, path=None):
+        self.factory = factory
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.lock = threading.Lock()
+        self.chats = OrderedDict() # chat_id -> Chat
+        if path and os.path.isfile(path): self.load()
+
+    def __len__(self): return len(self.chats)
+    def __contains__(self, chat_id): return chat_id in self.chats
+
+    def get(self, chat_id, now=None):
+        """ The chat's state, marked as seen now """
+        now = time.time() if now is None else now
+        with self.lock:
+            chat = self.chats.get(chat_id)
+            if chat is None:
+                chat = self.chats[chat_id] = self.factory(chat_id)
+            chat.last_seen = now
+            self.chats.move_to_end(chat_id)
+            self.evict(now)
+            return chat
+
+    def evict(self, now):
+        """ Drops expired and excess chats from the front, call with self.lock held """
+        while self.chats:
+            chat = next(iter(self.chats.values()))
+            if len(self.chats) <= self.capacity and chat.last_seen >= now - self.ttl: return
+            del self.chats[chat.chat_id]
+
+    def active(self, window=None, now=None):
+        """ Chats seen within the last window seconds, all of them if None """
+        now = time.time() if now is None else now
+        with self.lock:
+            self.evict(now)
+            return [c for c, chat in self.chats.items()
+                    if window is None or chat.last_seen >= now - window]
+
+    def save(self):
+        if not self.path: return
+        with self.lock:
+            rows = [[c, chat.last_seen, chat._date] for c, chat in self.chats.items()]
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(rows, f) # a list keeps int and str chat ids apart
+        os.replace(self.path + ".tmp", self.path)
+
+    def load(self):
+        with open(self.path) as f:
+            rows = json.load(f)
+        with self.lock:
+            for chat_id, last_seen, date in sorted(rows, key=lambda r: r[1]):
+                chat = self.chats[chat_id] = self.factory(chat_id)
+                chat.last_seen = last_seen
+                chat._date = date
+            self.evict(time.time())
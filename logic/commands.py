@@ -0,0 +1,44 @@
+from assertions import ArgSpec
+
+### COMMAND REGISTRY ###
+# Only methods marked with @command can be called from chat.
+# Usage strings are compiled into ArgSpecs once when the decorator runs,
+# so each message costs one dict lookup plus one arity check.
+
+def command(inputs=None, **qualifiers):
+    """ Marks a TeleBot method as a chat command.
+    inputs: usage string checked against all arguments, e.g. "<alias>[,<reason>]"
+    qualifiers: usage string per first argument, e.g. member="member <fullname>" """
+    def decorator(f):
+        f.command = Command(f.__name__, f, inputs, qualifiers)
+        return f
+    return decorator
+
+class Command:
+    __slots__ = ("name", "handler", "spec", "qualifiers")
+
+    def __init__(self, name, handler, inputs=None, qualifiers=None):
+        self.name = name
+        self.handler = handler
+        self.spec = None if inputs is None else ArgSpec(inputs)
+        self.qualifiers = {q: ArgSpec(i) for q, i in (qualifiers or {}).items()}
+
+    def check(self, args):
+        """ Returns a prompt if a qualifier is needed, raises AssertionError on bad arity """
+        if self.qualifiers:
+            if len(args) == 0:
+                return "Please specify a qualifier, e.g. `/{} <qualifier>`\n"\
+                       "where qualifier = `{}`".format(self.name, "/".join(self.qualifiers))
+            spec = self.qualifiers.get(args[0])
+            if spec is not None: spec.check(self.name, args)
+        elif self.spec is not None:
+            self.spec.check(self.name, args)
+
+def build_registry(cls):
+    """ Returns {name: Command} for all @command methods of cls """
+    registry = {}
+    for klass in reversed(cls.__mro__):
+        for name, attr in vars(klass).items():
+            if callable(attr) and hasattr(attr, "command"):
+                registry[name] = attr.command
+    return registry
@@ -0,0 +1,51 @@
+import atexit
+import threading
+import time
+
+class GroupCommitter:
+    """ Single background writer shared by all DBs.
+    A DB with pending mutations is flushed once its commit window has
+    passed, so a burst of check-ins costs one fsync instead of one each. """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = {} # db -> flush deadline
+        self.thread = None
+
+    def schedule(self, db, window):
+        with self.cond:
+            if db in self.pending: return # joins the open group
+            self.pending[db] = time.monotonic() + window
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.cond.notify()
+
+    def cancel(self, db):
+        with self.cond:
+            self.pending.pop(db, None)
+
+    def flush_all(self):
+        with self.cond:
+            dbs, self.pending = list(self.pending), {}
+        for db in dbs: db.flush()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending: self.cond.wait()
+                now = time.monotonic()
+                deadline = min(self.pending.values())
+                if deadline > now:
+                    self.cond.wait(deadline - now)
+                    continue
+                due = [db for db, d in self.pending.items() if d <= now]
+                for db in due: del self.pending[db]
+            for db in due:
+                try:
+                    db.flush()
+                except Exception as e:
+                    print("Group commit failed:", e)
+
+committer = GroupCommitter()
+atexit.register(committer.flush_all)
@@ -0,0 +1,95 @@
+import multiprocessing
+import queue
+import signal
+import threading
+from multiprocessing.connection import wait
+from workers import shard_of
+
+WORKER_DOWN = "Worker process stopped, command not run. Please tell the admin."
+
+def worker_main(factory, inbox, outbox, shard):
+    """ Worker process: owns the DBs, alias indexes and timers of its tenants """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # ingress decides when to stop
+    bot = factory(shard=shard)
+    bot.send_message = lambda chat_id, message: outbox.put((chat_id, message))
+    bot.save_chats() # /set dates, also every chat_save_interval
+
+    def start_up():
+        bot.start_up()
+        inbox.put(()) # wakes the loop below to pick up the new timers
+    threading.Thread(target=start_up, daemon=True).start() # serve messages meanwhile
+    while True:
+        try:
+            # Sleep until a message arrives or the next event is due
+            item = inbox.get(timeout=bot.scheduler.timeout())
+        except queue.Empty:
+            item = ()
+        bot.scheduler.run_due()
+        if item is None: break
+        if item: bot.handle_message(*item)
+    bot.tenants.close_all()
+    bot.chats.save()
+    outbox.put((None, shard[0])) # done
+
+class ProcessFanout:
+    """ Ingress side. Each tenant is pinned to one of n worker processes by
+    hashing its id, so per-chat order and tenant state stay in one process.
+    Replies come back on a shared queue and are passed to on_result.
+    If a worker dies, commands for its tenants are answered with WORKER_DOWN.
+    factory(shard=(i, n)) makes worker i's bot. Changing n moves tenants to
+    other workers, and their /set dates stay behind in the old worker's file. """
+
+    def __init__(self, n, factory, on_result):
+        self.inboxes = [multiprocessing.Queue() for _ in range(n)]
+        self.outbox = multiprocessing.Queue()
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.dead = set() # worker indexes
+        self.procs = [multiprocessing.Process(target=worker_main, daemon=True,
+                                              args=(factory, q, self.outbox, (i, n)))
+                      for i, q in enumerate(self.inboxes)]
+        for p in self.procs: p.start()
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, tenant, chat_id, text):
+        i = shard_of(tenant, len(self.inboxes))
+        with self.lock:
+            if i not in self.dead:
+                self.inboxes[i].put((chat_id, text))
+                return
+        self.on_result(chat_id, WORKER_DOWN)
+
+    def shutdown(self):
+        """ Lets workers finish queued messages, then waits for all replies """
+        for q in self.inboxes: q.put(None)
+        self.collector.join()
+        for p in self.procs: p.join()
+
+    def _collect(self):
+        running = set(range(len(self.procs)))
+        while running:
+            sentinels = {self.procs[i].sentinel: i for i in running}
+            # Same as concurrent.futures: the queue's pipe and the processes in one wait
+            ready = wait([self.outbox._reader] + list(sentinels))
+            if self.outbox._reader in ready:
+                # Replies first, a worker flushes them before it exits
+                chat_id, message = self.outbox.get()
+                if chat_id is None: running.discard(message)
+                else: self.on_result(chat_id, message)
+                continue
+            for sentinel in ready:
+                running.discard(sentinels[sentinel])
+                self.lost(sentinels[sentinel])
+
+    def lost(self, i):
+        """ Worker i died: later commands for it get WORKER_DOWN, so do those it never read """
+        self.procs[i].join()
+        print("Worker {} stopped with exit code {}.".format(i, self.procs[i].exitcode))
+        with self.lock: self.dead.add(i)
+        while True:
+            try:
+                item = self.inboxes[i].get(timeout=0.1)
+            except queue.Empty:
+                break
+            if item: self.on_result(item[0], WORKER_DOWN)
@@ -0,0 +1,78 @@
+import json
+import os
+import time
+
+class Journal:
+    """ Append-only log of DB mutations, one JSON event per line:
+    {"seq", "ts", "op", "args", "kwargs", "undo"}
+    undo is the list of [op, args] calls that revert the event.
+    An /undo is itself logged as {"op": "undo", "args": [seq, calls]}.
+    path=None keeps the log in memory only. """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self.seq = 0
+        self.since_snapshot = 0
+        self.f = None
+        if path is None: return
+        if os.path.isfile(path):
+            good = 0 # bytes up to the end of the last intact line
+            with open(path, "rb") as f:
+                for line in f:
+                    if line.strip():
+                        try:
+                            if not line.endswith(b"\n"): raise ValueError
+                            self.events.append(json.loads(line))
+                        except ValueError:
+                            break # torn write at the tail
+                    good += len(line)
+            if good < os.path.getsize(path):
+                # Cut the torn tail off, or it would hide every event appended after it
+                with open(path, "r+b") as f: f.truncate(good)
+            if self.events: self.seq = self.events[-1]["seq"]
+        self.f = open(path, "a")
+
+    def append(self, op, args, kwargs=None, undo=None):
+        self.seq += 1
+        event = {"seq": self.seq, "ts": time.time(), "op": op, "args": list(args),
+                 "kwargs": kwargs or {}, "undo": undo}
+        self.events.append(event)
+        self.since_snapshot += 1
+        if self.f is not None:
+            self.f.write(json.dumps(event) + "\n")
+            self.f.flush()
+        return event
+
+    def sync(self):
+        if self.f is not None: os.fsync(self.f.fileno())
+
+    def tail(self, after):
+        return [e for e in self.events if e["seq"] > after]
+
+    def last_undoable(self):
+        """ Latest event that has not been undone yet """
+        undone = set()
+        for event in reversed(self.events):
+            if event["op"] == "undo":
+                undone.add(event["args"][0])
+            elif event["seq"] not in undone:
+                return event
+        return None
+
+    def compact(self, upto):
+        """ Drops events up to seq upto, they are covered by a snapshot """
+        self.events = [e for e in self.events if e["seq"] > upto]
+        self.since_snapshot = 0
+        if self.f is None: return
+        self.f.close()
+        with open(self.path + ".tmp", "w") as f:
+            for event in self.events: f.write(json.dumps(event) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + ".tmp", self.path)
+        self.f = open(self.path, "a")
+
+    def close(self):
+        if self.f is not None: self.f.close()
+        self.f = None
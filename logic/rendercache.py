@@ -0,0 +1,32 @@
+import threading
+from collections import OrderedDict
+
+class RenderCache:
+    """ Bounded LRU of rendered report strings, shared by all tenants.
+    Each entry remembers the data version it was rendered from and is
+    only served while the caller still sees that version. """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.entries = OrderedDict() # key -> (version, text)
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, text):
+        with self.lock:
+            self.entries[key] = (version, text)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+report_cache = RenderCache()
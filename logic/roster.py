@@ -0,0 +1,34 @@
+class Member:
+    __slots__ = ("id", "name", "section", "contact", "status")
+
+    def __init__(self, id, name, section, contact, status):
+        self.id = id
+        self.name = name
+        self.section = (section or "").upper()
+        self.contact = contact
+        self.status = status
+
+class Roster:
+    """ In-memory copy of the details table.
+    sections maps both subsections and their letter to member names,
+    e.g. "S1" -> S1 members and "S" -> S, S1 and S2 members. """
+
+    def __init__(self, rows):
+        self.members = {} # name -> Member, in id order
+        self.sections = {}
+        for row in rows:
+            member = Member(*row)
+            self.members[member.name] = member
+            section = member.section
+            if not section: continue
+            self.sections.setdefault(section, []).append(member.name)
+            if len(section) > 1:
+                self.sections.setdefault(section[0], []).append(member.name)
+
+    def section_members(self, section):
+        if section == ".": return list(self.members)
+        return self.sections.get(section.upper(), [])
+
+    def in_section(self, name, section):
+        member = self.members.get(name)
+        return member is not None and member.section.startswith(section.upper())
@@ -0,0 +1,48 @@
+import heapq
+import itertools
+import threading
+import time
+
+class Scheduler:
+    """ Timer heap of one-off events, driven by whoever owns the loop.
+    The loop asks timeout() how long it may block, then calls run_due().
+    Events are keyed so they can be replaced or cancelled. """
+
+    def __init__(self):
+        self.heap = [] # [when, seq, key, f, args], f is None once cancelled
+        self.keys = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def schedule(self, when, key, f, *args):
+        """ when: unix time, replaces any event with the same key """
+        with self.lock:
+            self._cancel(key)
+            entry = [when, next(self.counter), key, f, args]
+            self.keys[key] = entry
+            heapq.heappush(self.heap, entry)
+
+    def cancel(self, key):
+        with self.lock: self._cancel(key)
+
+    def _cancel(self, key):
+        entry = self.keys.pop(key, None)
+        if entry is not None: entry[3] = None # dropped lazily when popped
+
+    def timeout(self, default=None):
+        """ Seconds until the next event, at most default (None blocks forever) """
+        with self.lock:
+            while self.heap and self.heap[0][3] is None: heapq.heappop(self.heap)
+            if not self.heap: return default
+            wait = max(0, self.heap[0][0] - time.time())
+        return wait if default is None else min(wait, default)
+
+    def run_due(self, now=None):
+        now = time.time() if now is None else now
+        while True:
+            with self.lock:
+                if not self.heap or self.heap[0][0] > now: return
+                when, _, key, f, args = heapq.heappop(self.heap)
+                if f is None: continue
+                del self.keys[key]
+            f(*args)
@@ -0,0 +1,34 @@
+import datetime
+import json
+import threading
+import time
+
+class StartupTimer:
+    """ Seconds from process start to each startup milestone, the last being
+    the first response sent. Reported once then, as one line on stdout and
+    appended as a JSON line to path if given, to compare across deploys. """
+
+    def __init__(self, start=None, path=None, final="first_response"):
+        self.start = time.perf_counter() if start is None else start
+        self.path = path
+        self.final = final
+        self.marks = {}
+        self.lock = threading.Lock()
+        self.reported = False
+
+    def mark(self, milestone):
+        """ Only the first occurrence of each milestone counts """
+        if self.reported or milestone in self.marks: return
+        with self.lock:
+            if self.reported or milestone in self.marks: return
+            self.marks[milestone] = time.perf_counter() - self.start
+            if milestone != self.final: return
+            self.reported = True
+        self.report()
+
+    def report(self):
+        print("Startup: " + ", ".join("{} {:.0f}ms".format(m, 1000*t) for m, t in self.marks.items()))
+        if self.path is None: return
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"time": datetime.datetime.now().isoformat(timespec="seconds"),
+                                "marks": self.marks}) + "\n")
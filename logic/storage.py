@@ -0,0 +1,81 @@
+from abc import ABC, abstractmethod
+
+class Storage(ABC):
+    """ Everything TeleBot and the scheduler may call on a tenant's DB.
+    algorithm.DB is the SQLite implementation, algorithm.MemoryDB keeps
+    everything in RAM. Dates are 'YYYY-MM-DD' strings or day ordinals.
+    A backend missing any abstract method fails when it is created. """
+
+    ### LIFECYCLE ###
+    @abstractmethod
+    def flush(self): pass
+    @abstractmethod
+    def close(self): pass
+    @abstractmethod
+    def snapshot(self, path=None): pass
+    @abstractmethod
+    def replicate(self, path): pass
+    @abstractmethod
+    def undo(self): pass
+    def last_undoable(self): return None # journal event undo() would revert
+    def warm(self): pass # optional, builds indexes ahead of the first command
+
+    ### MEMBERS AND ALIASES ###
+    @abstractmethod
+    def add_member(self, name, section, contact, status, *aliases): pass
+    @abstractmethod
+    def update_member(self, name, **info): pass
+    @abstractmethod
+    def update_status(self, name, status): pass
+    @abstractmethod
+    def update_contact(self, name, contact): pass
+    @abstractmethod
+    def update_section(self, name, section): pass
+    @abstractmethod
+    def update_name(self, name, rename, *aliases): pass
+    @abstractmethod
+    def delete_member(self, name): pass
+    @abstractmethod
+    def add_alias(self, target, *aliases): pass
+    @abstractmethod
+    def delete_alias(self, alias): pass
+    @abstractmethod
+    def match_alias_to_name(self, query): pass
+
+    ### PRACTICES ###
+    @abstractmethod
+    def add_session(self, date, time, sessiontype): pass
+    @abstractmethod
+    def delete_session(self, date): pass
+    @abstractmethod
+    def get_session_time(self, date): pass
+    @abstractmethod
+    def get_session_dt(self, date): pass
+    @abstractmethod
+    def get_sessions(self, start): pass
+
+    ### ATTENDANCE ###
+    @abstractmethod
+    def update_attendance(self, date, alias, text): pass
+    @abstractmethod
+    def set_present(self, date, alias): pass
+    @abstractmethod
+    def set_late(self, date, alias, reason=""): pass
+    @abstractmethod
+    def set_absent(self, date, alias, reason=""): pass
+    @abstractmethod
+    def set_absent_all(self, date): pass
+
+    ### REPORTS ###
+    @abstractmethod
+    def get_section_members(self, section): pass
+    @abstractmethod
+    def get_no_reason_report(self, date, section="."): pass
+    @abstractmethod
+    def get_not_present_report(self, date, section="."): pass
+    @abstractmethod
+    def get_full_report(self, date, section="."): pass
+    @abstractmethod
+    def get_report(self, date, mode="full", section="."): pass
+    @abstractmethod
+    def print(self, database=None): pass
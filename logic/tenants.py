@@ -0,0 +1,135 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Files of a single-DB deployment, also their names inside each tenant's directory
+LEGACY_FILES = {"path": "records.db", "aliases": "aliases.json",
+                "journal": "journal.log", "snapshot": "snapshot.db"}
+
+class TenantPool:
+    """ Opens one DB (records.db, aliases.json, journal) per tenant on first use.
+    At most `capacity` DBs stay open; beyond that the least recently used
+    tenant that no chat is currently using is closed.
+    root=None keeps every tenant in memory, factory overrides the backend.
+    legacy: tenant that takes over the single-DB files (records.db etc.
+    in legacy_dir) of deployments from before tenants, on its first open. """
+
+    def __init__(self, root="data", capacity=32, config=None, factory=None, legacy=None, legacy_dir="."):
+        self.root = root
+        self.legacy = legacy
+        self.legacy_dir = legacy_dir
+        old = os.path.join(legacy_dir, LEGACY_FILES["path"])
+        if legacy is None and root is not None and os.path.isfile(old):
+            print("Warning: {} is not used by any tenant, set LEGACY_TENANT to adopt it.".format(old))
+        self.capacity = capacity
+        self.config = config or {}
+        self.factory = factory or self.open_db
+        self.lock = threading.Lock()
+        self.dbs = OrderedDict() # tenant -> DB, least recently used first
+        self.leases = {}         # tenant -> number of chats using it
+        self.busy = {}           # tenant -> Event set once its DB is opened or closed
+
+    def config_for(self, tenant):
+        path = os.path.join(self.root, str(tenant))
+        os.makedirs(path, exist_ok=True)
+        config = dict(self.config, **{k: os.path.join(path, v) for k, v in LEGACY_FILES.items()})
+        if tenant == self.legacy: self.adopt_legacy(config)
+        return config
+
+    def adopt_legacy(self, config):
+        """ Moves the pre-tenant files in, unless the tenant already has a DB.
+        Opening it then runs the usual migrations on the old data. """
+        if os.path.isfile(config["path"]): return
+        if not os.path.isfile(os.path.join(self.legacy_dir, LEGACY_FILES["path"])): return
+        for key, name in LEGACY_FILES.items():
+            old = os.path.join(self.legacy_dir, name)
+            for suffix in ("", "-wal", "-shm") if key == "path" else ("",):
+                if os.path.isfile(old + suffix): os.replace(old + suffix, config[key] + suffix)
+
+    def open_db(self, tenant):
+        import algorithm # sqlite3 and co. load on first use, not at startup
+        if self.root is None: return algorithm.MemoryDB(self.config)
+        return algorithm.DB(self.config_for(tenant))
+
+    def read_sessions(self, tenant, start):
+        """ get_sessions(start) of a tenant. SQLite files are read directly
+        so a restart does not open (migrate, replay, fsync) every tenant. """
+        import algorithm
+        if self.root is not None and self.factory == self.open_db:
+            sessions = algorithm.read_sessions(self.config_for(tenant)["path"], start)
+            if sessions is not None: return sessions
+        db = self.acquire(tenant)
+        try:
+            return db.get_sessions(start)
+        finally:
+            self.release(tenant)
+
+    def acquire(self, tenant):
+        """ Opening and closing DBs (schema, migrations, journal replay, fsync)
+        happen outside self.lock, so a slow tenant only holds up its own chats """
+        while True:
+            with self.lock:
+                db = self.dbs.get(tenant)
+                busy = self.busy.get(tenant)
+                if db is not None:
+                    self.dbs.move_to_end(tenant)
+                    self.leases[tenant] = self.leases.get(tenant, 0) + 1
+                    closing = self.evict()
+                    break
+                if busy is None: # we open it, others wait on busy
+                    busy = self.busy[tenant] = threading.Event()
+                    self.leases[tenant] = self.leases.get(tenant, 0) + 1
+                    break
+            busy.wait() # being opened, or closed before it can be reopened
+        if db is None:
+            try:
+                db = self.factory(tenant)
+            except BaseException:
+                with self.lock:
+                    self.release_lease(tenant)
+                    del self.busy[tenant]
+                busy.set()
+                raise
+            with self.lock:
+                self.dbs[tenant] = db
+                del self.busy[tenant]
+                closing = self.evict()
+            busy.set()
+        self.close(closing)
+        return db
+
+    def release(self, tenant):
+        with self.lock:
+            self.release_lease(tenant)
+            closing = self.evict()
+        self.close(closing)
+
+    def release_lease(self, tenant):
+        self.leases[tenant] -= 1
+        if self.leases[tenant] == 0: del self.leases[tenant]
+
+    def evict(self):
+        """ Takes idle tenants out until within capacity, call with self.lock held.
+        Returns them for close(), which must run after the lock is released. """
+        closing = []
+        for tenant in list(self.dbs):
+            if len(self.dbs) <= self.capacity: break
+            if tenant in self.leases: continue
+            closing.append((tenant, self.dbs.pop(tenant)))
+            self.busy[tenant] = threading.Event()
+        return closing
+
+    def close(self, closing):
+        for tenant, db in closing:
+            try:
+                db.close()
+            finally:
+                with self.lock: busy = self.busy.pop(tenant)
+                busy.set()
+
+    def close_all(self):
+        with self.lock:
+            closing = list(self.dbs.items())
+            self.dbs.clear()
+            for tenant, _ in closing: self.busy[tenant] = threading.Event()
+        self.close(closing)
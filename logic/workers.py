@@ -0,0 +1,50 @@
+import queue
+import threading
+import zlib
+
+def shard_of(chat_id, n):
+    """ Stable shard index for a chat, same across processes """
+    if type(chat_id) is int: return chat_id % n
+    return zlib.crc32(str(chat_id).encode()) % n
+
+class ChatWorkerPool:
+    """ Runs jobs on n threads, one queue per thread.
+    Jobs for the same chat always land on the same queue, so they run
+    in order, while different chats can run in parallel. """
+
+    def __init__(self, n=4):
+        self.queues = [queue.Queue() for _ in range(n)]
+        self.errors = []
+        self.lock = threading.Lock()
+        self.threads = []
+        for q in self.queues:
+            t = threading.Thread(target=self._run, args=(q,), daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, chat_id, f, *args):
+        self.queues[shard_of(chat_id, len(self.queues))].put((f, args))
+
+    def join(self):
+        """ Blocks until all submitted jobs are done, reraises the first failure since the last join """
+        for q in self.queues: q.join()
+        with self.lock: error = self.errors.pop() if self.errors else None
+        if error is not None: raise error
+
+    def shutdown(self):
+        for q in self.queues: q.put(None)
+        for t in self.threads: t.join()
+
+    def _run(self, q):
+        while True:
+            job = q.get()
+            try:
+                if job is None: return
+                f, args = job
+                f(*args)
+            except BaseException as e:
+                print("Worker job failed: {!r}".format(e)) # nobody else sees it in production
+                with self.lock:
+                    if not self.errors: self.errors.append(e) # only the first, for join()
+            finally:
+                q.task_done()
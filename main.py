@@ -7,63 +7,124 @@
 # https://chrisyeh96.github.io/2017/08/08/definitive-guide-python-imports.html
 # https://stackoverflow.com/questions/714063/importing-modules-from-parent-folder/11158224#11158224
 import os, sys; sys.path.insert(0, os.path.join(os.getcwd(), "logic"))
+from time import perf_counter; STARTED = perf_counter() # startup report counts from here
 
+# Kept light for a fast start: requests, algorithm (sqlite3) and fanout
+# (multiprocessing) are imported where first needed
 import constants
 from time import sleep # avoid 'time' conflict in namespace
-import requests
 import json
-import algorithm
-from inspect import signature
 import datetime
 import signal
+import threading
+from functools import partial
 from assertions import *
+from commands import command, build_registry
+from workers import ChatWorkerPool, shard_of
+from tenants import TenantPool
+from chats import Chat, ChatRegistry
+from scheduler import Scheduler
+from startup import StartupTimer
+IMPORTED = perf_counter()
 
 class SIGINT_handler():
     # https://stackoverflow.com/a/43787607
     def __init__(self): self.SIGINT = False
     def handler(self, signal, frame): self.SIGINT = True
 
-def main():
+def main(processes=None):
     handler = SIGINT_handler()
     signal.signal(signal.SIGINT, handler.handler)
-    bot = TeleBot()
+    if processes is None: processes = getattr(constants, "PROCESSES", 0)
+    bot = TeleBot(processes=processes)
+    bot.startup.mark("ready")
+    # Polling starts right away, worker processes schedule and warm up their own
+    if not bot.fanout: threading.Thread(target=bot.start_up, daemon=True).start()
+    bot.save_chats()
+    poll_timeout = getattr(constants, "POLL_TIMEOUT", 10)
     
     while True:
         if handler.SIGINT: break
-        bot.get_updates()
+        # Long poll until an update arrives or the next event is due
+        bot.get_updates(bot.scheduler.timeout(poll_timeout))
         bot.process_updates()
-        sleep(0.5)
+        bot.scheduler.run_due()
     
     bot.terminate()
 
+def as_date(date):
+    """ 'YYYY-M-D' or a day ordinal -> datetime.date, algorithm.DT without loading algorithm """
+    if isinstance(date, int): return datetime.date.fromordinal(date)
+    return datetime.date(*map(int, date.split("-")))
+
 def tokenize(text):
-    """ Splits tokens and preserves quote-enclosed blobs """
-    text = text.split('"')
-    args = []
-    for i in range(len(text)):
-        # Quote-enclosed strings are odd-numbered
-        if i % 2 == 0:
-            for div in text[i].split(" "):
-                if div != "": args.append(div)
+    """ Splits tokens and preserves quote-enclosed blobs, \" is a literal quote """
+    args, token = [], []
+    quoted = escaped = False
+    for ch in text:
+        if escaped:
+            token.append(ch)
+            escaped = False
+        elif ch == "\\":
+            escaped = True
+        elif ch == '"':
+            # Quote-enclosed strings are kept even if empty
+            if quoted or token: args.append("".join(token))
+            token = []
+            quoted = not quoted
+        elif ch == " " and not quoted:
+            if token: args.append("".join(token))
+            token = []
         else:
-            args.append(text[i])
+            token.append(ch)
+    if escaped: token.append("\\")
+    if token or quoted: args.append("".join(token))
     return args
 
 class TeleBot:
 
-    def __init__(self, failviolently=False):
-        from unit_tests import abstractDB
+    def __init__(self, failviolently=False, processes=0, threads=None, shard=None):
+        """ processes: fan chats out to this many worker processes, 0 runs them here
+        threads: worker threads per process, 0 handles messages inline
+        shard: (i, n) in fan-out worker i, which keeps its own chats file """
         self.failviolently = failviolently
         self.token = constants.TOKEN
-        self.db = algorithm.DB()
-        self.url = "https://api.telegram.org/bot{}/".format(self.token)
+        self.tenants = TenantPool(getattr(constants, "DATA_DIR", "data"),
+                                  getattr(constants, "MAX_OPEN_TENANTS", 32),
+                                  legacy=getattr(constants, "LEGACY_TENANT", None)) # adopts ./records.db
+        self.tenant_map = getattr(constants, "TENANTS", {}) # chat_id -> organisation
+        # Bounded per-chat state, saved so the shutdown notice survives restarts.
+        # With processes the ingress only knows who was active; /set dates live
+        # in the workers, worker i saves them to CHATS_FILE.i
+        chats_file = getattr(constants, "CHATS_FILE", "chats.json")
+        if shard is not None: chats_file = "{}.{}".format(chats_file, shard[0])
+        self.shard = shard
+        self.chats = ChatRegistry(lambda chat_id: Chat(chat_id, self.tenant_of(chat_id), lambda: self.tenants),
+                                  getattr(constants, "MAX_CHATS", 10000),
+                                  getattr(constants, "CHAT_TTL", 30*86400), # secs idle before forgotten
+                                  chats_file)
+        self.chat_save_interval = getattr(constants, "CHAT_SAVE_INTERVAL", 300) # secs
+        self.notice_window = getattr(constants, "SHUTDOWN_NOTICE_WINDOW", 86400) # secs, None for all
+        self.scheduler = Scheduler()
+        self.absent_offset = getattr(constants, "ABSENT_OFFSET", 30) # mins after start
+        self.reminder_lead = getattr(constants, "REMINDER_LEAD", 60) # mins before, 0 disables
+        # API_URL can point at a local stand-in, see benchmarks/fake_telegram.py
+        self.url = getattr(constants, "API_URL", "https://api.telegram.org/bot{}/").format(self.token)
         
         self.next_offset = None
         self.updates = None
-        self.active_chats = set()
+        self.fanout = None
+        if processes:
+            from fanout import ProcessFanout
+            # Workers run a headless TeleBot; replies are sent from here.
+            # Started before any threads so forking is safe.
+            self.fanout = ProcessFanout(processes, partial(TeleBot, failviolently, threads=0),
+                                        lambda chat_id, message: self.submit(chat_id, self.send_message, chat_id, message))
+        if threads is None: threads = getattr(constants, "WORKERS", 4)
+        self.workers = ChatWorkerPool(threads) if threads else None
         self.start_time = datetime.datetime.now()
-
-        self.cur_date = algorithm.DT(datetime.datetime.now()).to_date()
+        self.startup = StartupTimer(STARTED, getattr(constants, "STARTUP_LOG", None))
+        self.startup.marks["imports"] = IMPORTED - STARTED
 
     def terminate(self):
         uptime = datetime.datetime.now() - self.start_time
@@ -72,21 +133,39 @@ class TeleBot:
         else:
             tss = "{} days".format(uptime.days)
         
-        for chat_id in self.active_chats:
-            self.send_message(chat_id, "Server has terminated bot.\nTotal uptime: {}.".format(tss))
+        if self.fanout: self.fanout.shutdown() # finish pending commands first
+        # Only recently active chats are told, in parallel but after their last reply
+        notice = "Server has terminated bot.\nTotal uptime: {}.".format(tss)
+        chat_ids = self.chats.active(self.notice_window)
+        if self.workers:
+            for chat_id in chat_ids: self.workers.submit(chat_id, self.send_message, chat_id, notice)
+            self.workers.shutdown()
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(16) as pool:
+                for chat_id in chat_ids: pool.submit(self.send_message, chat_id, notice)
+        self.tenants.close_all()
+        self.chats.save()
 
     def send_message(self, chat_id, message):
+        import requests
         payload = {"text": message, "chat_id": chat_id}
         if "`" in message: payload["parse_mode"] = "Markdown" # auto format-detection
         requests.get(self.url + "sendMessage", params=payload)
+        self.startup.mark("first_response")
 
     def retrieve_message(error_message, message):
         return error_message if bool(error_message) else message
 
-    def get_updates(self):
-        payload = {"offset": self.next_offset} # to confirm receipt of message
-        r = requests.get(self.url + "getUpdates", params=payload)
+    def get_updates(self, timeout=0):
+        """ Long polls for up to timeout seconds """
+        import requests
+        if timeout < 1: sleep(timeout) # Bot API only waits in whole seconds
+        payload = {"offset": self.next_offset, "timeout": int(timeout)} # offset confirms receipt
+        r = requests.get(self.url + "getUpdates", params=payload, timeout=int(timeout) + 10)
         self.updates = r.json()
+        self.startup.mark("first_poll")
+        if self.updates.get("result"): self.startup.mark("first_update")
 
     def process_updates(self):
         if "result" not in self.updates: return
@@ -101,172 +180,284 @@ class TeleBot:
             if "text" not in result["message"]: continue
             chat_id = result["message"]["chat"]["id"]
             text = result["message"]["text"]
-            self.active_chats.add(chat_id)
+            self.chats.get(chat_id) # seen now
+            if self.fanout: self.fanout.submit(self.tenant_of(chat_id), chat_id, text)
+            else: self.submit(chat_id, self.handle_message, chat_id, text)
+
+    def submit(self, chat_id, f, *args):
+        """ Runs f on the chat's worker thread, or right away without threads """
+        if self.workers: self.workers.submit(chat_id, f, *args)
+        else: f(*args)
+
+    def tenant_of(self, chat_id):
+        return self.tenant_map.get(chat_id, chat_id)
+
+    def tenant_chats(self, tenant):
+        return [c for c, t in self.tenant_map.items() if t == tenant] or [tenant]
+
+    def chat(self, chat_id):
+        return self.chats.get(chat_id)
+
+    def save_chats(self):
+        """ Saves the chat registry now and then every chat_save_interval """
+        self.chats.save()
+        self.scheduler.schedule(datetime.datetime.now().timestamp() + self.chat_save_interval,
+                                "save_chats", self.save_chats)
 
+    def handle_message(self, chat_id, text):
+        """ Runs on the chat's worker thread """
+        chat = self.chat(chat_id)
+        try:
+            if not text.lstrip().startswith("/"): return # ignore non-bot-commands
+            args = tokenize(text)
+            cmd, args = args[0][1:], args[1:]
+            if "@" in cmd: cmd = cmd.split("@")[0] # ignore calls such as /new@bot
             try:
-                if text.lstrip()[0] != "/": continue # ignore non-bot-commands
-                args = tokenize(text)
-                cmd, args = args[0][1:], args[1:]
-                if "@" in cmd: cmd = cmd.split("@")[0] # ignore calls such as /new@bot
-                try:
-                    assert hasattr(self, cmd), "/{} does not exist.".format(cmd)
-                    response = getattr(self, cmd)(*args)
-                    self.send_message(chat_id, response)
-                except AssertionError as e:
-                    self.send_message(chat_id, str(e))
-            except BaseException as e:
-                self.send_message(chat_id, "UNCAUGHT BUG!!")
-                if self.failviolently: raise e
-                print(e) # temporary scaffold to highlight exceptions during testing
+                command = self.commands.get(cmd)
+                assert command is not None, "/{} does not exist.".format(cmd)
+                response = command.check(args) or command.handler(self, chat, *args)
+                self.send_message(chat_id, response)
+            except AssertionError as e:
+                self.send_message(chat_id, str(e))
+        except BaseException as e:
+            self.send_message(chat_id, "UNCAUGHT BUG!!")
+            if self.failviolently: raise e
+            print(e) # temporary scaffold to highlight exceptions during testing
+        finally:
+            chat.release()
                     
+    ### SCHEDULED EVENTS ###
+
+    def start_up(self):
+        """ Startup work kept off the first poll, run in the background.
+        Events get scheduled at most one poll late, they are hours ahead anyway. """
+        self.schedule_upcoming()
+        self.startup.mark("scheduled")
+        self.warm_up()
+
+    def owns(self, tenant):
+        """ False for tenants of other fan-out workers """
+        return self.shard is None or shard_of(tenant, self.shard[1]) == self.shard[0]
+
+    def warm_up(self):
+        """ Opens the tenants of the most recently seen chats and builds their
+        alias indexes ahead of their first command, up to the pool's capacity """
+        tenants = []
+        for chat_id in reversed(self.chats.active()):
+            tenant = self.tenant_of(chat_id)
+            if tenant in tenants or not self.owns(tenant): continue
+            tenants.append(tenant)
+            if len(tenants) >= self.tenants.capacity: break
+        for tenant in tenants:
+            try:
+                db = self.tenants.acquire(tenant)
+                try:
+                    db.warm()
+                finally:
+                    self.tenants.release(tenant)
+            except Exception as e:
+                print("Cannot warm up tenant {}: {!r}".format(tenant, e))
+        self.startup.mark("warm")
+
+    def schedule_upcoming(self):
+        """ Schedules events for sessions already in the tenant DBs, e.g. after a restart.
+        A fan-out worker only takes the tenants it owns. """
+        root = self.tenants.root
+        if root is None or not os.path.isdir(root): return # nothing persisted
+        today = datetime.date.today().isoformat()
+        for name in os.listdir(root):
+            tenant = int(name) if name.lstrip("-").isdigit() else name
+            if not self.owns(tenant): continue
+            try:
+                sessions = self.tenants.read_sessions(tenant, today)
+            except Exception as e: # e.g. a corrupt records.db, the other tenants still run
+                print("Cannot schedule tenant {}: {!r}".format(tenant, e))
+                continue
+            for date, session_time in sessions:
+                self.schedule_session(tenant, date, session_time)
+
+    def schedule_session(self, tenant, date, session_time):
+        """ Reminder before the session starts, absent-all some time after """
+        hour, minute = map(int, session_time.split(":"))
+        start = datetime.datetime.combine(as_date(date), datetime.time(hour, minute)).timestamp()
+        now = datetime.datetime.now().timestamp()
+        remind_at = start - 60*self.reminder_lead
+        if self.reminder_lead and remind_at > now:
+            self.scheduler.schedule(remind_at, ("remind", tenant, date),
+                                    self.submit_event, tenant, self.remind, date, session_time)
+        absent_at = start + 60*self.absent_offset
+        if absent_at > now:
+            self.scheduler.schedule(absent_at, ("absentall", tenant, date),
+                                    self.submit_event, tenant, self.auto_absentall, date)
+
+    def cancel_session(self, tenant, date):
+        self.scheduler.cancel(("remind", tenant, date))
+        self.scheduler.cancel(("absentall", tenant, date))
+
+    def submit_event(self, tenant, f, *args):
+        self.submit(self.tenant_chats(tenant)[0], f, tenant, *args)
+
+    def remind(self, tenant, date, session_time):
+        for chat_id in self.tenant_chats(tenant):
+            self.send_message(chat_id, "Reminder: practice on {} starts at `{}`.".format(date, session_time))
+
+    def auto_absentall(self, tenant, date):
+        db = self.tenants.acquire(tenant)
+        try:
+            response = db.set_absent_all(date)
+        finally:
+            self.tenants.release(tenant)
+        for chat_id in self.tenant_chats(tenant):
+            self.send_message(chat_id, response)
+
     ### COMMANDS ###
 
-    def help(self):
+    @command()
+    def help(self, chat, *args):
         return 'Format: `/<cmd> <arguments>`\n'\
              + 'For arguments with whitespace, enclose within "".\n'\
              + 'For more help, type `/<cmd>` and follow the prompts.\n\n'\
              + 'Possible cmds:\n`new`, `edit`, `delete`, `set`, `now`,\n'\
-             + '`add`, `present`, `late`, `absent(all)`, `report`'
+             + '`add`, `present`, `late`, `absent(all)`, `report`, `undo`'
             
-    def hello(self):
+    @command()
+    def hello(self, chat, *args):
         return "Hello World! :)"
 
-    def prompt_qualifier(f):
-        def wrapper(*args, **kwargs):
-            if len(args) == 1:
-                text = "Please specify a qualifier, e.g. `/{} <qualifier>`\n".format(f.__name__)
-                if f.__name__ in ("new","delete"): text += "where qualifier = `member/alias/practice`"
-                if f.__name__ == "edit": text += "where qualifier = `name/section/contact/status`"
-            r = f(*args, **kwargs)
-            return r
-        return wrapper
-
-    @prompt_qualifier
-    def new(self, qualifier, *args):
+    @command(member="member <fullname> <section> <contact> <status>[,*<alias>]",
+             alias="alias <curralias> <alias>[,*<alias>]",
+             practice="practice <YYYY-MM-DD> <HH-MM> <sessiontype>")
+    def new(self, chat, qualifier, *args):
         
         if qualifier == "member":
-            inputs = "member <fullname> <section> <contact> <status>[,*<alias>]"
-            assert_cmd("new", inputs, qualifier, *args)
             assert_section(args[1])
             assert_contact(args[2])
-            return self.db.add_member(*args)
+            return chat.db.add_member(*args)
 
         if qualifier == "alias":
-            inputs = "alias <curralias> <alias>[,*<alias>]"
-            assert_cmd("new", inputs, qualifier, *args)
-            return self.db.add_alias(*args)
+            return chat.db.add_alias(*args)
         
         if qualifier == "practice":
-            inputs = "practice <YYYY-MM-DD> <HH-MM> <sessiontype>"
-            assert_cmd("new", inputs, qualifier, *args)
             assert_datetime(args[0], args[1])
-            return self.db.add_session(*args)
+            response = chat.db.add_session(*args)
+            self.schedule_session(chat.tenant, as_date(args[0]).isoformat(),
+                                  chat.db.get_session_time(args[0]))
+            return response
         
         return "No such qualifier '{}' available.\nUse: `/new <member/alias/practice>`".format(qualifier)
                 
-    @prompt_qualifier         
-    def delete(self, qualifier, *args):
+    @command(member="member <fullname>",
+             alias="alias <alias>[,*<alias>]",
+             practice="practice <YYYY-MM-DD>")
+    def delete(self, chat, qualifier, *args):
                 
         if qualifier == "member":
-            inputs = "member <fullname>"
-            assert_cmd("delete", inputs, qualifier, *args)
-            return self.db.delete_member(*args)
+            return chat.db.delete_member(*args)
                 
         if qualifier == "alias":
-            inputs = "alias <alias>[,*<alias>]"
-            assert_cmd("delete", inputs, qualifier, *args)
-            return "\n".join(map(lambda s: self.db.delete_alias(self, s), args))
+            return "\n".join(map(lambda s: chat.db.delete_alias(s), args))
                 
         if qualifier == "practice":
-            inputs = "practice <YYYY-MM-DD>"
-            assert_cmd("delete", inputs, qualifier, *args)
             assert_date(*args)
-            return self.db.delete_session(*args)
+            self.cancel_session(chat.tenant, as_date(args[0]).isoformat())
+            return chat.db.delete_session(*args)
 
         return "No such qualifier '{}' available.\nUse: `/delete <member/alias/practice>`".format(qualifier)
 
-    @prompt_qualifier
-    def edit(self, qualifier, *args):
+    @command(name="name <oldname> <newname>[,*<alias>]",
+             section="section <fullname> <section>",
+             contact="contact <fullname> <contact>",
+             status="status <fullname> <status>")
+    def edit(self, chat, qualifier, *args):
                 
         if qualifier == "name":
-            inputs = "name <oldname> <newname>[,*<alias>]"
-            assert_cmd("edit", inputs, qualifier, *args)
-            return self.db.update_name(*args)
+            return chat.db.update_name(*args)
                 
         if qualifier == "section":
-            inputs = "section <fullname> <section>"
-            assert_cmd("edit", inputs, qualifier, *args)
             assert_section(args[1])
-            return self.db.update_section(*args)
+            return chat.db.update_section(*args)
             
         if qualifier == "contact": # ("contact", "Full Name", "contact")
-            inputs = "contact <fullname> <contact>"
-            assert_cmd("edit", inputs, qualifier, *args)
             assert_contact(args[1])
-            return self.db.update_contact(*args)
+            return chat.db.update_contact(*args)
             
         if qualifier == "status": # ("status", "Full Name", "status")
-            inputs = "status <fullname> <status>"
-            assert_cmd("edit", inputs, qualifier, *args)
-            return self.db.update_status(*args)
+            return chat.db.update_status(*args)
 
         return "No such qualifier '{}' available.\nUse: `/edit <name/section/contact/status>`".format(qualifier)
 
                 
     ### FUNCTIONS BELOW ASSUME DATE HAS ALREADY BEEN SET VIA set ###
 
-    def now(self, *args):
-        day = algorithm.DT(self.cur_date).day_of_week()
-        return "Current date is `{}, {}`.".format(day, self.cur_date)
+    @command()
+    def now(self, chat, *args):
+        day = as_date(chat.cur_date).strftime("%A")
+        return "Current date is `{}, {}`.".format(day, chat.cur_date)
     
-    def set(self, *args):
-        inputs = "<YYYY-MM-DD>"
-        assert_cmd("set", inputs, *args)
+    @command("<YYYY-MM-DD>")
+    def set(self, chat, *args):
         assert_date(args[0])
-        self.cur_date = algorithm.DT(args[0]).to_date()
-        day = algorithm.DT(self.cur_date).day_of_week()
-        return "Current date is now set to `{}, {}`.".format(day, self.cur_date)
-
-    def add(self, *args):
-        inputs = "<alias>[,*<alias>]"
-        assert_cmd("add", inputs, *args)
-        if datetime.datetime.now() < self.db.get_session_dt(self.cur_date):
-            return self.present(*args)
-        return "\n".join(map(lambda s: self.late(s), args))
-
-    def present(self, *args):
-        inputs = "<alias>[,*<alias>]"
-        assert_cmd("present", inputs, *args)
-        return "\n".join(map(lambda s: self.db.set_present(self.cur_date, s), args))
-
-    def late(self, *args):
-        inputs = "<alias>[,<reason>]"
-        assert_cmd("late", inputs, *args)              
-        return self.db.set_late(self.cur_date, *args)
-
-    def absent(self, *args):
-        inputs = "<alias>[,<reason>]"
-        assert_cmd("absent", inputs, *args)
-        return self.db.set_absent(self.cur_date, *args)
-
-    def absentall(self, *args):
-        return self.db.set_absent_all(self.cur_date)
+        date = as_date(args[0])
+        chat.cur_date = date.isoformat()
+        day = date.strftime("%A")
+        return "Current date is now set to `{}, {}`.".format(day, chat.cur_date)
+
+    @command("<alias>[,*<alias>]")
+    def add(self, chat, *args):
+        if datetime.datetime.now() < chat.db.get_session_dt(chat.cur_date):
+            return self.present(chat, *args)
+        return "\n".join(map(lambda s: self.late(chat, s), args))
+
+    @command("<alias>[,*<alias>]")
+    def present(self, chat, *args):
+        return "\n".join(map(lambda s: chat.db.set_present(chat.cur_date, s), args))
+
+    @command("<alias>[,<reason>]")
+    def late(self, chat, *args):
+        return chat.db.set_late(chat.cur_date, *args)
+
+    @command("<alias>[,<reason>]")
+    def absent(self, chat, *args):
+        return chat.db.set_absent(chat.cur_date, *args)
+
+    @command()
+    def absentall(self, chat, *args):
+        return chat.db.set_absent_all(chat.cur_date)
+        
+    @command()
+    def undo(self, chat, *args):
+        event = chat.db.last_undoable()
+        response = chat.db.undo()
+        # Undoing /new or /delete practice adds or drops a session, timers follow
+        for op, args, *_ in (event or {}).get("undo") or []:
+            if op not in ("add_session", "delete_session"): continue
+            date = as_date(args[0]).isoformat()
+            session = chat.db.get_sessions(date)[:1]
+            if session and session[0][0] == date: self.schedule_session(chat.tenant, *session[0])
+            else: self.cancel_session(chat.tenant, date)
+        return response
         
     ### REPORT GENERATION ###
 
-    def report(self, section=".", *args):
-        inputs = "<section=.>[,<mode=/reason/absent/section>]"
-        assert_cmd("report", inputs, section, *args)
+    @command("<section=.>[,<mode=/reason/absent/section>]")
+    def report(self, chat, section=".", *args):
         if section != ".": assert_section(section)
-        if len(args) == 0: return self.db.get_full_report(self.cur_date, section)
+        if len(args) == 0: return chat.db.get_full_report(chat.cur_date, section)
         mode = args[0]
-        if mode == "reason": return self.db.get_no_reason_report(self.cur_date, section)
-        if mode == "absent": return self.db.get_not_present_report(self.cur_date, section)
-        if mode == "section": return self.db.get_section_members(section)
+        if mode == "reason": return chat.db.get_no_reason_report(chat.cur_date, section)
+        if mode == "absent": return chat.db.get_not_present_report(chat.cur_date, section)
+        if mode == "section": return chat.db.get_section_members(section)
         return "No such mode '{}' available.\nUse: `/report <section=.>[,<mode=/reason/absent/section>]`".format(mode)
 
-    def print(self):
-        return self.db.print()
+    @command()
+    def print(self, chat, *args):
+        return chat.db.print()
+
+TeleBot.commands = build_registry(TeleBot) # built once at startup
                 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=None,
+                        help="fan chats out to this many worker processes")
+    main(parser.parse_args().processes)
@@ -3,13 +3,37 @@ import os, sys; sys.path.insert(0, os.path.join(os.getcwd(), "logic"))
 
 from algorithm import *
 from main import *
+from fanout import ProcessFanout
+import fanout as fanout_module
+from journal import Journal
+import tempfile
+from contextlib import contextmanager
+import threading
+import time
 
 failviolently = False
 
 def main():
     print("Running tests...")
     test_DT()
+    test_date_migration()
+    test_group_commit()
+    test_tokenize()
+    test_commands()
     test_TeleBot()
+    test_tenants()
+    test_absentall()
+    test_roster()
+    test_journal()
+    test_report_cache()
+    test_memory_db()
+    test_scheduler()
+    test_concurrent_chats()
+    test_process_fanout()
+    test_loadgen()
+    test_scalability()
+    test_fast_start()
+    test_chat_registry()
 
 def _(predicate, errormsg):
     """ assert equal and continue test """
@@ -33,6 +57,24 @@ def test_result(f):
         print("{} {}.".format(f.__name__, "passed" if no_test_failure else "failed"))
     return wrapper
 
+@contextmanager
+def temp_constants(**values):
+    """ Overrides constants within the block """
+    missing = object()
+    old = {k: getattr(constants, k, missing) for k in values}
+    for k, v in values.items(): setattr(constants, k, v)
+    try:
+        yield
+    finally:
+        for k, v in old.items():
+            if v is missing: delattr(constants, k)
+            else: setattr(constants, k, v)
+
+def temp_config(d, **config):
+    """ DB config keeping every file under directory d """
+    return dict(config, path=os.path.join(d, "records.db"), aliases=os.path.join(d, "aliases.json"),
+                journal=os.path.join(d, "journal.log"), snapshot=os.path.join(d, "snapshot.db"))
+
 @test_result
 def test_DT():
     dt1 = DT("2018-09-13")
@@ -41,17 +83,99 @@ def test_DT():
     _(dt2.to_time() == "19:47", "to_time method")
     td21 = datetime.timedelta(0, 71220)
     _(dt2.to_dt() - dt1.to_dt() == td21, "datetime parsing")        
+    _(dt1.day_of_week() == "Thursday", "day_of_week")
+    _(DT.from_ordinal(dt1.to_ordinal(), 1187).to_time() == "19:47", "from_ordinal")
+    _(to_ordinal("2018-9-13") == dt1.to_ordinal() == datetime.date(2018, 9, 13).toordinal(), "to_ordinal")
+    _(ordinal_to_date(to_ordinal("2018-9-13")) == "2018-09-13", "ordinal_to_date")
+    _(minutes_to_time(to_minutes("9:05")) == "09:05", "minutes round trip")
 
-class abstractDB():
+@test_result
+def test_date_migration():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "records.db")
+        legacy = sqlite3.connect(path)
+        legacy.execute("CREATE TABLE attendance (date TEXT, time TEXT, sessiontype TEXT, 'Audrey' TEXT)")
+        legacy.execute("INSERT INTO attendance VALUES ('2018-09-13', '9:30', 'practice', 'present')")
+        legacy.commit()
+        legacy.close()
+        db = DB(temp_config(d))
+        _(db.get_sessions("2018-01-01") == [("2018-09-13", "09:30")], "legacy dates not migrated")
+        _(db.get_session_dt("2018-09-13") == datetime.datetime(2018, 9, 13, 9, 30), "get_session_dt")
+        _(db.get_full_report("2018-09-13") == str({"Audrey": "present"}), "member columns lost")
+        _(str(("2018-09-13", "09:30", "practice", "present")) in db.print(), "/print shows ordinals")
+        indexes = db.conn.execute("PRAGMA index_list(attendance)").fetchall()
+        _(any(i[1] == "attendance_date" for i in indexes), "date index missing")
+        db.close()
+
+@test_result
+def test_group_commit():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "records.db")
+        db = DB(temp_config(d, commit_window=0.2))
+        db.add_member("Audrey", "S1", "91234567", "active")
+        db.add_session("2018-09-13", "19:30", "practice")
+        db.set_present("2018-09-13", "audrey")
+        _(db.dirty, "mutations committed before window")
+        _(db.get_full_report("2018-09-13") == str({"Audrey": "present"}), "reader misses own writes")
+        db.set_late("2018-09-13", "audrey")
+        time.sleep(0.4)
+        _(not db.dirty, "group commit never ran")
+        other = sqlite3.connect(path)
+        _(other.execute("SELECT Audrey FROM attendance").fetchone() == ("late",), "not durable")
+        other.close()
+        _(db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal", "WAL not enabled")
+        db.close()
+
+        # /add looks up the session before each check-in, that must not flush the batch
+        db = DB(temp_config(d, commit_window=60))
+        db.add_session("2018-09-20", "19:30", "practice")
+        flushes, flush = [], db.flush
+        db.flush = lambda: flushes.append(1) or flush()
+        for i in range(20):
+            _(db.get_session_dt("2018-09-20") == datetime.datetime(2018, 9, 20, 19, 30), "session time")
+            db.set_late("2018-09-20", "audrey", str(i))
+        _(flushes == [], "session lookup flushed the group commit")
+        db.close()
+
+@test_result
+def test_tokenize():
+    _(tokenize(' /new  " alias " ali') == ["/new", " alias ", "ali"], "quoted blob")
+    _(tokenize('/late p ""') == ["/late", "p", ""], "empty quotes")
+    _(tokenize(r'/new alias "the \"boss\"" b\"b') == ["/new", "alias", 'the "boss"', 'b"b'], "escaped quotes")
+    _(tokenize("/report") == ["/report"], "single token")
+
+@test_result
+def test_commands():
+    _("terminate" not in TeleBot.commands, "non-command method exposed")
+    _("send_message" not in TeleBot.commands, "non-command method exposed")
+    _(TeleBot.commands["new"].check([]).startswith("Please specify"), "qualifier prompt")
+    spec = ArgSpec("<section=.>[,<mode=/reason/absent/section>]")
+    _(spec.argc == 1 and spec.op_argc == 1 and spec.defaults == 1, "default arg spec")
+    try:
+        TeleBot.commands["late"].check(["p", "politics", "stuff"])
+        _(False, "arity not enforced")
+    except AssertionError: pass
+
+class abstractDB(Storage):
 
     def __init__(self):
         self.cur_dt = datetime.datetime.now()
 
+    def close(self): pass
+    def flush(self): pass
+    def snapshot(self, path=None): pass
+    def replicate(self, path): pass
+    def undo(self): return "Nothing to undo."
+
     def add_member(self, name, section, contact, status, *aliases):
         if name == "duplicate": return "Duplicate member found!"
         if len(aliases) == 1: return "Duplicate alias found!"
         return "Member added!"
 
+    def update_member(self, name, **info):
+        if name == "notfound": return "Member not found!"
+        return "Member updated!"
+
     def update_status(self, name, status):
         if name == "notfound": return "Member not found!"
         return "Status updated!"
@@ -81,6 +205,8 @@ class abstractDB():
         if len(aliases) == 1: return "Duplicate alias found!"
         return "Aliases deleted!"
 
+    def match_alias_to_name(self, query): return "" if query == "notfound" else query
+
     # To shift datetime to DB instead of TeleBot,
     # this will also make Telebot consistent in using only string reprs... nah
     def parse_to_dt(self, date): return datetime.datetime(1970, 2, 15)
@@ -104,6 +230,8 @@ class abstractDB():
         if date == "notfound": return "Practice not found!"
         return "Practice deleted!"
 
+    def get_sessions(self, start): return []
+
     def set_dt(self, date):
         assert type(date) is str
         self.cur_dt = DT(date).to_dt()
@@ -115,6 +243,11 @@ class abstractDB():
         if late:
             return "\n".join(map(lambda s: self.late(self, chat_id, s), args))
 
+    def update_attendance(self, date, alias, text):
+        assert type(date) is str
+        if alias == "notfound": return "Alias not found!"
+        return "Attendance updated!"
+
     def set_present(self, date, *aliases):
         assert type(date) is str
         if date == "notfound": return "Practice not found!"
@@ -151,17 +284,20 @@ class abstractDB():
     def get_no_reason_report(self, date, section="."): return "No reason report." # to update reasons
     def get_not_present_report(self, date, section="."): return "Not present report." # to update status
     def get_section_members(self, section="."): return "Member report." # for reference
+    def get_report(self, date, mode="full", section="."): return "Report."
+    def print(self, database=None): return "Tables."
 
 @test_result
 def test_TeleBot():
     bot = TeleBot(True)
     bot.send_message = print # lambda *x: x
-    bot.db = abstractDB()
+    bot.tenants = TenantPool(factory=lambda tenant: abstractDB())
     def c(text):
         bot.next_offset = None
         bot.updates = {"result": [{"message":{"chat":{"id":""}, "text":text}, "update_id":2}]}
         print("\n>>> " + text)
         bot.process_updates()
+        bot.workers.join()
 
     c(' /new  " alias " ali')
     c('/new')
@@ -218,5 +354,495 @@ def test_TeleBot():
     c('/report b1 absent rah')
 
 
+@test_result
+def test_tenants():
+    with tempfile.TemporaryDirectory() as d:
+        pool = TenantPool(d, capacity=2)
+        a = pool.acquire("a")
+        a.add_member("Audrey", "S1", "91234567", "active")
+        pool.release("a")
+        b = pool.acquire("b")
+        _(b.match_alias_to_name("audrey") == "", "tenants share a roster")
+        pool.acquire("c") # b is still leased, a is idle
+        _(list(pool.dbs) == ["b", "c"], "LRU idle tenant not evicted")
+        pool.acquire("d")
+        _(len(pool.dbs) == 3, "leased tenants must stay open")
+        pool.release("b"); pool.release("c"); pool.release("d")
+        _(len(pool.dbs) == 2, "pool not shrunk after release")
+        a = pool.acquire("a")
+        _(a.match_alias_to_name("audrey") == "Audrey", "tenant not reloaded from disk")
+        pool.release("a")
+        pool.close_all()
+
+    # A slow open only holds up its own tenant
+    opened = threading.Event()
+    def slow(tenant):
+        if tenant == "slow": opened.wait(5)
+        return abstractDB()
+    pool = TenantPool(factory=slow)
+    waiter = threading.Thread(target=pool.acquire, args=("slow",))
+    waiter.start()
+    time.sleep(0.05)
+    start = time.time()
+    pool.acquire("fast")
+    _(time.time() - start < 1, "pool lock held while opening a DB")
+    opened.set()
+    waiter.join()
+    _(pool.leases == {"slow": 1, "fast": 1} and not pool.busy, "leases after concurrent opens")
+
+    # A pre-tenant deployment's records.db and aliases.json move into the legacy tenant
+    with tempfile.TemporaryDirectory() as d:
+        legacy = sqlite3.connect(os.path.join(d, "records.db"))
+        legacy.execute("CREATE TABLE details (id INTEGER PRIMARY KEY NOT NULL, name TEXT, section TEXT, contact INTEGER, status TEXT)")
+        legacy.execute("INSERT INTO details (name, section, contact, status) VALUES ('Audrey', 'S1', 91234567, 'active')")
+        legacy.execute("CREATE TABLE attendance (date TEXT, time TEXT, sessiontype TEXT, 'Audrey' TEXT)")
+        legacy.execute("INSERT INTO attendance VALUES ('2018-09-13', '19:30', 'practice', 'present')")
+        legacy.commit()
+        legacy.close()
+        with open(os.path.join(d, "aliases.json"), "w") as f: json.dump({"audrey": "Audrey", "aud": "Audrey"}, f)
+        pool = TenantPool(os.path.join(d, "data"), legacy=-100, legacy_dir=d)
+        db = pool.acquire(-100)
+        _(db.match_alias_to_name("aud") == "Audrey", "legacy aliases not adopted")
+        _(db.get_full_report("2018-09-13") == str({"Audrey": "present"}), "legacy records not adopted")
+        _(not os.path.isfile(os.path.join(d, "records.db")), "legacy records.db left behind")
+        pool.release(-100)
+        _(pool.acquire(7).match_alias_to_name("aud") == "", "other tenants took legacy data")
+        pool.release(7)
+        pool.close_all()
+
+    bot = TeleBot(True)
+    bot.tenants = TenantPool(factory=lambda tenant: abstractDB())
+    replies = []
+    bot.send_message = lambda chat_id, message: replies.append((chat_id, message))
+    bot.handle_message(1, "/set 2018-9-13")
+    _(replies[-1][1] == "Current date is now set to `Thursday, 2018-09-13`.", "set reply")
+    bot.handle_message(2, "/now")
+    _(bot.chat(1).cur_date == "2018-09-13", "date not set")
+    _("2018-09-13" not in replies[-1][1], "date leaked to another chat")
+    _(bot.tenants.leases == {}, "lease not returned")
+
+@test_result
+def test_absentall():
+    db = MemoryDB()
+    for name in ("Audrey", "Ben", "Cat"): db.add_member(name, "S1", "91234567", "active")
+    db.add_session("2018-09-13", "19:30", "practice")
+    db.set_present("2018-09-13", "audrey")
+    db.set_late("2018-09-13", "ben", "train")
+    _(db.set_absent_all("2018-09-13") == "Absence marked for 2018-09-13 practice.", "absentall failed")
+    _(db.get_full_report("2018-09-13") == str({"Audrey": "present", "Ben": "late: train", "Cat": "absent"}),
+      "marked members overwritten")
+    db.close()
+
+@test_result
+def test_roster():
+    db = MemoryDB()
+    db.add_member("Audrey", "s1", "91234567", "active")
+    db.add_member("Ben", "S2", "91234567", "active")
+    db.add_member("Cat", "A1", "91234567", "active")
+    _(db.get_section_members("S") == str(["Audrey", "Ben"]), "letter index")
+    _(db.get_section_members("s2") == str(["Ben"]), "subsection index")
+    db.update_section("Ben", "a2")
+    _(db.get_section_members("A") == str(["Ben", "Cat"]), "roster not invalidated on update")
+    db.delete_member("Cat")
+    _("Cat" not in db.get_roster().members, "roster not invalidated on delete")
+    db.add_session("2018-09-13", "19:30", "practice")
+    db.set_present("2018-09-13", "audrey")
+    _(db.get_full_report("2018-09-13", "s") == str({"Audrey": "present"}), "section report")
+    _(db.add_member("Audrey", "S1", "9", "active") == "Audrey already exists.", "duplicate check")
+    _(db.delete_member("time") == "time not found.", "session column taken for a member")
+    _(db.get_session_time("2018-09-13") == "19:30", "session column dropped")
+    _(db.add_member("O'Brien", "T1", "91234567", "active", "ob") == "O'Brien added.", "quote in name")
+    db.set_late("2018-09-13", "ob", "bus")
+    _(db.get_full_report("2018-09-13", "t") == str({"O'Brien": "late: bus"}), "quoted member not marked")
+    db.delete_member("O'Brien")
+    _("O'Brien" not in db.get_roster().members, "quoted member not deleted")
+    db.close()
+
+@test_result
+def test_journal():
+    with tempfile.TemporaryDirectory() as d:
+        db = DB(temp_config(d, commit_window=0))
+        db.add_member("Audrey", "S1", "91234567", "active", "audi")
+        db.add_member("Ben", "S2", "91234567", "active")
+        db.add_session("2018-09-13", "19:30", "practice")
+        db.set_present("2018-09-13", "audi")
+        db.set_late("2018-09-13", "audi", "train")
+        _(db.undo() == "Undid `mark_attendance 2018-09-13 Audrey late: train`.", "undo message")
+        _(db.get_full_report("2018-09-13") == str({"Audrey": "present", "Ben": None}), "undo attendance")
+        db.set_absent_all("2018-09-13")
+        db.undo()
+        _(db.get_full_report("2018-09-13") == str({"Audrey": "present", "Ben": None}), "undo absentall")
+        db.delete_member("Audrey")
+        db.undo()
+        _(db.get_full_report("2018-09-13") == str({"Ben": None, "Audrey": "present"}), "undo delete_member")
+        _(db.match_alias_to_name("audi") == "Audrey", "aliases not restored")
+        db.update_name("Ben", "Benjamin")
+        db.undo()
+        _(db.get_section_members("S") == str(["Ben", "Audrey"]), "undo rename")
+
+        # A failed mutation leaves nothing behind for the next commit
+        _(db.update_name("Ben", "Audrey") == "Audrey already exists.", "rename onto a member")
+        db.update_member("Ben", section="S1")
+        try:
+            db.update_member("Ben", section="A1", rename="time") # clashes with a session column
+            _(False, "rename onto a session column")
+        except sqlite3.Error: pass
+        db.add_session("2018-09-20", "19:30", "practice")
+        other = sqlite3.connect(os.path.join(d, "records.db"))
+        _(other.execute("SELECT name, section FROM details ORDER BY id").fetchall()
+          == [("Ben", "S1"), ("Audrey", "S1")], "partial mutation committed")
+        other.close()
+        _(db.get_section_members("S1") == str(["Ben", "Audrey"]), "roster cache stale")
+
+        # Snapshot, lose records.db, then recover from snapshot + journal tail
+        db.snapshot()
+        db.set_absent("2018-09-13", "ben", "sick")
+        db.replicate(os.path.join(d, "backup.db"))
+        report = db.get_full_report("2018-09-13")
+        db.close()
+        os.remove(os.path.join(d, "records.db"))
+        db = DB(temp_config(d, commit_window=0))
+        _(db.get_full_report("2018-09-13") == report, "recovery lost changes")
+        _(db.match_alias_to_name("audi") == "Audrey", "aliases not recovered")
+        db.close()
+        backup = sqlite3.connect(os.path.join(d, "backup.db"))
+        _(backup.execute("SELECT Ben FROM attendance").fetchone() == ("absent: sick",), "replica stale")
+        backup.close()
+
+        # A torn tail is cut off, so events appended after it still load
+        path = os.path.join(d, "torn.log")
+        journal = Journal(path)
+        journal.append("op", [1])
+        journal.append("op", [2])
+        journal.close()
+        with open(path, "a") as f: f.write('{"seq": 3, "op"')
+        journal = Journal(path)
+        journal.append("op", [3])
+        journal.append("op", [4])
+        journal.close()
+        _([e["seq"] for e in Journal(path).events] == [1, 2, 3, 4], "events lost after torn write")
+
+@test_result
+def test_report_cache():
+    from rendercache import report_cache
+    db = MemoryDB()
+    db.add_member("Audrey", "S1", "91234567", "active")
+    db.add_member("Ben", "A1", "91234567", "active")
+    db.add_session("2018-09-13", "19:30", "practice")
+    db.add_session("2018-09-20", "19:30", "practice")
+    _(db.get_not_present_report("2018-09-13", "s") == str({"Audrey": None}), "first render")
+    hits = report_cache.hits
+    _(db.get_not_present_report("2018-09-13", "s") == str({"Audrey": None}), "cached render")
+    _(report_cache.hits == hits + 1, "repeat report not served from cache")
+    db.set_present("2018-09-20", "audrey")
+    db.get_not_present_report("2018-09-13", "s")
+    _(report_cache.hits == hits + 2, "other session's write invalidated entry")
+    db.set_present("2018-09-13", "audrey")
+    _(db.get_not_present_report("2018-09-13", "s") == str({}), "stale after attendance write")
+    db.update_section("Ben", "S2")
+    _(db.get_full_report("2018-09-13", "s") == str({"Audrey": "present", "Ben": None}), "stale after roster write")
+    _(db.get_section_members("s") == str(["Audrey", "Ben"]), "stale section list")
+
+    # In-memory tenants share a path, their entries must not evict each other
+    other = MemoryDB()
+    other.add_member("Carol", "S1", "91234567", "active")
+    other.add_session("2018-09-13", "19:30", "practice")
+    _(other.get_not_present_report("2018-09-13", "s") == str({"Carol": None}), "other tenant's report")
+    _(db.get_not_present_report("2018-09-13", "s") == str({"Ben": None}), "tenant mixed up")
+    hits = report_cache.hits
+    for _i in range(2):
+        _(db.get_not_present_report("2018-09-13", "s") == str({"Ben": None}), "tenant mixed up")
+        _(other.get_not_present_report("2018-09-13", "s") == str({"Carol": None}), "tenant mixed up")
+    _(report_cache.hits == hits + 4, "alternating tenants not served from cache")
+    other.close()
+    db.close()
+
+@test_result
+def test_memory_db():
+    _(not MemoryDB.__abstractmethods__, "Storage methods not implemented: {}".format(MemoryDB.__abstractmethods__))
+    class partialDB(Storage):
+        def close(self): pass
+    try:
+        partialDB()
+        _(False, "incomplete backend created")
+    except TypeError: pass
+    before = set(os.listdir("."))
+    start = time.time()
+    dbs = [MemoryDB() for _ in range(1000)]
+    elapsed = time.time() - start
+    dbs[0].add_member("Audrey", "S1", "91234567", "active")
+    dbs[0].add_session("2018-09-13", "19:30", "practice")
+    dbs[1].add_session("2018-09-13", "19:30", "practice")
+    dbs[0].set_present("2018-09-13", "audrey")
+    _(dbs[1].match_alias_to_name("audrey") == "", "in-memory DBs not isolated")
+    _(dbs[1].get_full_report("2018-09-13") == str({}), "in-memory reports not isolated")
+    for db in dbs: db.close()
+    _(set(os.listdir(".")) == before, "in-memory DB touched the filesystem")
+    print("1000 in-memory DBs opened in {:.3f}s".format(elapsed))
+
+@test_result
+def test_scheduler():
+    fired = []
+    sched = Scheduler()
+    now = time.time()
+    sched.schedule(now + 30, "b", fired.append, "b")
+    sched.schedule(now + 10, "a", fired.append, "a")
+    sched.schedule(now + 20, "c", fired.append, "c")
+    sched.cancel("c")
+    _(9 < sched.timeout() <= 10, "wakes at the wrong time")
+    _(sched.timeout(5) == 5, "default cap ignored")
+    sched.run_due(now + 25)
+    _(fired == ["a"], "cancelled or early events fired")
+    sched.schedule(now + 40, "b", fired.append, "b2") # replaces
+    sched.run_due(now + 50)
+    _(fired == ["a", "b2"], "event not replaced")
+    _(sched.timeout() is None, "empty heap should block")
+
+    bot = TeleBot(True, threads=0)
+    bot.tenants = TenantPool(factory=lambda tenant: abstractDB())
+    replies = []
+    bot.send_message = lambda chat_id, message: replies.append((chat_id, message))
+    date = DT(datetime.datetime.now() + datetime.timedelta(days=2)).to_date()
+    bot.handle_message(7, "/new practice {} 19:47 b9".format(date))
+    _(set(k[0] for k in bot.scheduler.keys) == {"remind", "absentall"}, "session events not scheduled")
+    bot.scheduler.run_due(DT(date, "19:47").to_dt().timestamp() + 60*bot.absent_offset)
+    _(replies[-2:] == [(7, "Reminder: practice on {} starts at `19:47`.".format(date)),
+                       (7, "Set all as absent!")], "events not fired")
+    _(bot.tenants.leases == {}, "lease not returned")
+
+    # Undoing a session change brings its timers in line
+    bot.tenants = TenantPool(root=None) # chat 8 is new, so it picks this pool up
+    bot.handle_message(8, "/new practice {} 19:47 b9".format(date))
+    bot.handle_message(8, "/undo")
+    _(not bot.scheduler.keys, "timers left for an undone session")
+    bot.handle_message(8, "/new practice {} 19:47 b9".format(date))
+    bot.handle_message(8, "/delete practice {}".format(date))
+    bot.handle_message(8, "/undo")
+    _(set(k[0] for k in bot.scheduler.keys) == {"remind", "absentall"}, "restored session not rescheduled")
+
+    # A tenant that fails to open does not stop the others from being scheduled
+    with tempfile.TemporaryDirectory() as d:
+        bot.tenants = TenantPool(d)
+        bot.scheduler = Scheduler()
+        db = bot.tenants.acquire(6)
+        db.add_session(date, "19:47", "practice")
+        bot.tenants.release(6)
+        bot.tenants.close_all()
+        for tenant in (5, 7):
+            os.makedirs(os.path.join(d, str(tenant)))
+            with open(os.path.join(d, str(tenant), "records.db"), "w") as f: f.write("garbage" * 1000)
+        bot.schedule_upcoming()
+        _(set(k[1] for k in bot.scheduler.keys) == {6}, "one broken tenant stopped scheduling")
+        _(not bot.tenants.dbs, "tenants opened just to read their sessions")
+
+        # Warm-up opens the tenants of the most recently seen chats
+        bot.tenants = TenantPool(d, capacity=1)
+        bot.chats.get(9, now=time.time() + 10)
+        bot.chats.get(6, now=time.time() + 20)
+        bot.warm_up()
+        _(list(bot.tenants.dbs) == [6], "warmed tenants not chosen by last seen")
+        _(bot.tenants.dbs[6].alias_index is not None, "alias index not built")
+        bot.tenants.close_all()
+
+class fakeBotAPI():
+    """ Local stand-in for the Bot API: scripted updates in, sent messages recorded """
+
+    def __init__(self):
+        self.update_id = 0
+        self.pending = []
+        self.sent = {}
+        self.lock = threading.Lock()
+
+    def post(self, chat_id, text):
+        self.update_id += 1
+        self.pending.append({"update_id": self.update_id,
+                             "message": {"chat": {"id": chat_id}, "text": text}})
+
+    def get_updates(self):
+        result, self.pending = self.pending, []
+        return {"ok": True, "result": result}
+
+    def send_message(self, chat_id, message):
+        with self.lock:
+            self.sent.setdefault(chat_id, []).append((time.time(), message))
+
+class echoDB(abstractDB):
+    def set_present(self, date, alias): return alias
+    def get_full_report(self, date, section="."):
+        time.sleep(0.5) # slow report
+        return "Full report."
+
+@test_result
+def test_concurrent_chats():
+    bot = TeleBot(True)
+    bot.tenants = TenantPool(factory=lambda tenant: echoDB())
+    api = fakeBotAPI()
+    bot.send_message = api.send_message
+    chats, burst = 200, 20
+
+    api.post(0, "/report")
+    for i in range(burst):
+        for chat_id in range(1, chats):
+            api.post(chat_id, "/present {}".format(i))
+    start = time.time()
+    bot.updates = api.get_updates()
+    bot.process_updates()
+    bot.workers.join()
+    elapsed = time.time() - start
+
+    report_done = api.sent[0][0][0]
+    for chat_id in range(1, chats):
+        replies = [m for _, m in api.sent[chat_id]]
+        _(replies == [str(i) for i in range(burst)], "chat {} out of order".format(chat_id))
+    # Chats on other shards must not wait for the slow report
+    _(api.sent[1][-1][0] < report_done, "chat 1 blocked by chat 0")
+    print("{} commands over {} chats in {:.3f}s".format(chats*burst - burst + 1, chats, elapsed))
+    bot.workers.shutdown()
+
+    # Failing jobs are logged, only the first is kept for join()
+    pool = ChatWorkerPool(2)
+    def fail(i): raise ConnectionError("send {} failed".format(i))
+    for i in range(50): pool.submit(i, fail, i)
+    for q in pool.queues: q.join()
+    _(len(pool.errors) == 1, "job errors pile up")
+    try:
+        pool.join()
+        _(False, "job error swallowed")
+    except ConnectionError: pass
+    pool.shutdown()
+
+
+def echo_bot(d, shard=None):
+    """ Headless bot for worker processes, keeping its files under directory d """
+    with temp_constants(CHATS_FILE=os.path.join(d, "chats.json"), DATA_DIR=os.path.join(d, "data")):
+        bot = TeleBot(threads=0, shard=shard)
+    bot.tenants = TenantPool(os.path.join(d, "data"), factory=lambda tenant: echoDB())
+    return bot
+
+@test_result
+def test_process_fanout():
+    replies = {}
+    def on_result(chat_id, message): replies.setdefault(chat_id, []).append(message)
+    chats, burst = 50, 20
+    with tempfile.TemporaryDirectory() as d:
+        fanout = ProcessFanout(4, partial(echo_bot, d), on_result)
+        start = time.time()
+        for i in range(burst):
+            for chat_id in range(chats):
+                fanout.submit(chat_id, chat_id, "/present {}".format(i))
+        fanout.shutdown()
+    elapsed = time.time() - start
+    _(all(p.exitcode == 0 for p in fanout.procs), "worker process crashed")
+    for chat_id in range(chats):
+        _(replies.get(chat_id) == [str(i) for i in range(burst)], "chat {} out of order".format(chat_id))
+    print("{} commands over 4 processes in {:.3f}s".format(chats*burst, elapsed))
+
+    # A dead worker's chats get an error reply, and shutdown still returns
+    replies.clear()
+    tenants = {shard_of(t, 2): t for t in range(10)}
+    with tempfile.TemporaryDirectory() as d:
+        fanout = ProcessFanout(2, partial(broken_bot, d), on_result)
+        for i in range(3): fanout.submit(tenants[1], tenants[1], "/present {}".format(i))
+        fanout.procs[1].join()
+        fanout.submit(tenants[1], tenants[1], "/present 3")
+        fanout.submit(tenants[0], tenants[0], "/present 0")
+        fanout.shutdown()
+    _(replies[tenants[1]] == [fanout_module.WORKER_DOWN]*4, "commands to a dead worker unanswered")
+    _(replies[tenants[0]] == ["0"], "other worker affected")
+
+def broken_bot(d, shard=None):
+    """ Worker 1 fails to start """
+    if shard[0] == 1: raise RuntimeError("file is not a database")
+    return echo_bot(d, shard)
+
+
+@test_result
+def test_loadgen():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    import loadgen
+    setup, bursts = loadgen.generate(chats=3, members=5, bursts=2)
+    _(len(setup) == 3*(2+5), "setup commands")
+    stats = loadgen.run(setup, bursts, threads=2, out=lambda *args: None)
+    _(stats["commands"] == sum(map(len, bursts)), "not every command answered")
+    _(0 < stats["p50"] <= stats["p99"] <= stats["max"], "latency percentiles")
+    _(stats["throughput"] > 0, "throughput")
+
+@test_result
+def test_scalability():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+    import scalability
+    rows = scalability.roster(30)
+    _(len(set(r[2] for r in rows)) == 30, "nicknames not unique")
+    report = scalability.run([30], [5], samples=4, out=lambda *args: None)
+    ops = set(r["op"] for r in report["results"])
+    _(ops >= {"bktree.build", "BKTree.search", "match_alias_to_name", "add_member",
+              "delete_member", "update_attendance", "get_report"}, "ops missing")
+    _(not any("error" in r for r in report["results"]), "benchmark failed")
+    _(json.loads(json.dumps(report))["samples"] == 4, "not JSON serialisable")
+
+@test_result
+def test_fast_start():
+    import subprocess
+    probe = "import main, sys; print(sorted(m for m in ('requests', 'algorithm', 'sqlite3', "\
+            "'multiprocessing', 'inspect', 'unit_tests') if m in sys.modules))"
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True,
+                         env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    _(out.stdout.strip() == "[]", "heavy imports at startup: " + (out.stdout + out.stderr).strip())
+
+    db = MemoryDB()
+    db.add_member("Audrey", "S1", "91234567", "active", "aud")
+    _(MemoryDB().alias_index is None, "alias index built on open")
+    db.rebuild_index()
+    db.warm()
+    _(db.alias_index is not None, "warm did not build the index")
+    _(db.match_alias_to_name("adrey") == "Audrey", "fuzzy match after warm")
+    db.delete_alias("aud")
+    _(db.alias_index is None and db.match_alias_to_name("audrey") == "Audrey", "lazy rebuild")
+
+    timer = StartupTimer(time.perf_counter())
+    for milestone in ("ready", "first_poll", "first_poll", "first_response", "late"): timer.mark(milestone)
+    _(list(timer.marks) == ["ready", "first_poll", "first_response"], "milestones not recorded once")
+
+@test_result
+def test_chat_registry():
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "chats.json")
+        make = lambda chat_id: Chat(chat_id, chat_id, None)
+        chats = ChatRegistry(make, capacity=3, ttl=100, path=path)
+        for i, chat_id in enumerate([1, 2, "@choir", 1, 4]): chats.get(chat_id, now=1000 + i)
+        _(list(chats.chats) == ["@choir", 1, 4], "LRU eviction")
+        _(chats.get(1, now=1003).cur_date == datetime.date.today().isoformat(), "default date")
+        chats.get(1, now=1003).cur_date = "2018-09-13"
+        _(chats.active(window=1, now=1004) == [4, 1], "active window")
+        chats.save()
+        restored = ChatRegistry(make, ttl=10**10, path=path)
+        _(list(restored.chats) == ["@choir", 1, 4], "load order")
+        _(restored.get(1).cur_date == "2018-09-13", "date not persisted")
+        _(chats.active(now=1150) == [] and len(chats) == 0, "TTL eviction")
+
+        bot = TeleBot(True)
+        bot.tenants = TenantPool(factory=lambda tenant: abstractDB())
+        bot.chats = ChatRegistry(bot.chats.factory, path=path)
+        bot.notice_window = 60
+        sent = []
+        bot.send_message = lambda chat_id, message: sent.append(chat_id)
+        bot.chats.get(7, now=time.time() - 3600)
+        for chat_id in range(8, 20): bot.chats.get(chat_id)
+        bot.terminate()
+        _(sorted(sent) == list(range(8, 20)), "shutdown notice not limited to active chats")
+        _(len(json.load(open(path))) == 13, "registry not saved on terminate")
+
+        # Fan-out: each worker keeps the /set dates of its chats in its own file
+        fanout = ProcessFanout(2, partial(echo_bot, d), lambda chat_id, message: None)
+        for chat_id in range(4): fanout.submit(chat_id, chat_id, "/set 2018-09-1{}".format(chat_id))
+        fanout.shutdown()
+        dates = {}
+        for i in range(2):
+            for chat_id, _seen, date in json.load(open("{}.{}".format(path, i))): dates[chat_id] = date
+        _(dates == {c: "2018-09-1{}".format(c) for c in range(4)}, "fan-out dates not persisted")
+        restored = echo_bot(d, shard=(shard_of(3, 2), 2))
+        _(restored.chat(3).cur_date == "2018-09-13", "fan-out dates not restored")
+        _(restored.chat(3).db.get_session_time("") == "19:47", "chat bound to the pool it was loaded with")
+
 if __name__ == "__main__":
     main()